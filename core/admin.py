@@ -9,7 +9,7 @@ from django.template.loader import render_to_string
 from django.utils.html import mark_safe
 from django.urls import reverse
 from django.contrib.admin.utils import quote
-from .models import Nfe, Cte, Item, Log, MemoriaIa, Cliente, ProdutoMap, Transportadora
+from .models import Nfe, Cte, Item, Log, MemoriaIa, Cliente, ProdutoMap, Transportadora, GeoCache
 
 # ==============================================================================
 # AÇÕES DE EXPORTAÇÃO (CSV)
@@ -325,6 +325,13 @@ class LogAdmin(NavigationMixin, admin.ModelAdmin):
 class MemoriaIaAdmin(NavigationMixin, admin.ModelAdmin):
     list_display = ('cfop', 'fluxo', 'tipo_definido')
     readonly_fields = ('navigation_buttons',)
+
+@admin.register(GeoCache)
+class GeoCacheAdmin(NavigationMixin, admin.ModelAdmin):
+    list_display = ('consulta', 'encontrado', 'latitude', 'longitude', 'data_atualizacao')
+    list_filter = ('encontrado',)
+    search_fields = ('consulta',)
+    readonly_fields = ('navigation_buttons', 'data_atualizacao')
     
 
 # ==============================================================================
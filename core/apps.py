@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'core'
\ No newline at end of file
+    name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (conecta os receivers de Nfe/Cte)
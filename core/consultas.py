@@ -0,0 +1,288 @@
+# consultas.py
+# Filtros do dashboard/análise aplicados no banco. Uma fatia estreita (uma
+# filial num mês, por ex.) vira um WHERE no Nfe e só as notas da fatia passam
+# pelo pandas (rateio do frete e o resto que o SQL não expressa bem). KPIs e
+# gráficos do dashboard saem do cubo ResumoDiario, filtrado aqui também, e
+# dele sai o índice das opções dos filtros das duas telas.
+import hashlib
+import json
+import operator
+from functools import reduce
+import numpy as np
+import pandas as pd
+from django.db.models import Q, F, Sum, Count, Case, When, Value, CharField, OuterRef, Subquery, Exists
+from django.db.models.functions import Coalesce, ExtractYear, ExtractMonth, ExtractDay
+from django.conf import settings
+from django.core.cache import cache
+from django.core import signing
+from .models import Nfe, Cte, ResumoDiario
+from . import services, snapshot
+
+FILTROS_LISTA = ('ano', 'mes', 'dia', 'filial', 'cliente', 'transp', 'mod_frete', 'tipo_op')
+NENHUMA = Q(pk__in=[])
+
+def ler_filtros(get, busca=False):
+    """Filtros do GET; com busca=True inclui os campos de texto da análise (numero_cte/numero_nf)."""
+    filtros = {k: get.getlist(k) for k in FILTROS_LISTA}
+    if busca:
+        filtros['numero_cte'] = get.get('numero_cte', '').strip()
+        filtros['numero_nf'] = get.get('numero_nf', '').strip()
+    return filtros
+
+def ler_ordem(get):
+    """Coluna e sentido da ordenação da tabela da análise (padrão: data, mais recentes primeiro)."""
+    ordem = get.get('ordem', 'data')
+    if ordem not in COLUNAS_ORDENAVEIS: ordem = 'data'
+    return ordem, get.get('dir', 'desc') != 'asc'
+
+def tem_filtro(filtros):
+    return any(filtros.values())
+
+def usar_banco(filtros):
+    """
+    Filtra no banco quando há filtro e o snapshot não está pronto (evita montar
+    o histórico inteiro), quando a busca é por número de NF ou quando a fatia é
+    pequena. Fatia grande com snapshot pronto continua no pandas, que já tem
+    tudo em memória. O tamanho da fatia sai do índice das opções (em cache),
+    sem contar notas no banco.
+    """
+    if not tem_filtro(filtros): return False
+    if snapshot.versao_publicada() is None: return True
+    if filtros.get('numero_nf'): return True
+    return tamanho_fatia(filtros) <= settings.DASHBOARD_FATIA_MAX
+
+def tamanho_fatia(filtros):
+    """Notas que passam nos filtros do cubo, somadas na faceta de ano (a busca por CT-e só reduz)."""
+    if not filtros.get('ano'): return sum(qtd for _, qtd in opcoes(filtros)['ano'])
+    anos = {int(v) for v in filtros['ano'] if str(v).isdigit()}
+    return sum(qtd for ano, qtd in opcoes(filtros)['ano'] if ano in anos)
+
+# ==============================================================================
+# FILTROS NO DATAFRAME (FATIA GRANDE, SNAPSHOT EM MEMÓRIA)
+# ==============================================================================
+# Filtro da tela -> coluna já tipada do DataFrame do dashboard
+COLUNAS_FILTRO = {
+    'ano': 'Ano', 'mes': 'Mes', 'dia': 'Dia', 'filial': 'Emitente_Legivel', 'cliente': 'Destinatario_Legivel',
+    'transp': 'Transportadora_Final', 'mod_frete': 'Frete_Tipo', 'tipo_op': 'Operacao',
+}
+
+def mascara(df, filtros):
+    """
+    Os mesmos filtros do notas_filtradas como uma única máscara booleana
+    (NumPy) sobre o DataFrame. Não copia nem altera o df: quem usa escolhe as
+    linhas e colunas que precisa materializar.
+    """
+    m = np.ones(len(df), dtype=bool)
+    for chave, col in COLUNAS_FILTRO.items():
+        valores = filtros.get(chave)
+        if not valores: continue
+        if chave in ('ano', 'mes', 'dia'): valores = [int(v) for v in valores if str(v).isdigit()]
+        m &= df[col].isin(valores).to_numpy()
+    if filtros.get('numero_cte'):
+        m &= df['numero_cte'].str.contains(filtros['numero_cte'], na=False, regex=False).to_numpy(dtype=bool)
+    if filtros.get('numero_nf'):
+        m &= (df['numero_nf'] == filtros['numero_nf']).to_numpy(dtype=bool, na_value=False)
+    return m
+
+# ==============================================================================
+# COLUNAS CALCULADAS DO DATAFRAME, EM SQL
+# ==============================================================================
+def nome_legivel(col_cnpj, col_nome):
+    """Emitente_Legivel/Destinatario_Legivel: apelido da filial (config) ou o nome do XML."""
+    whens = [When(**{col_cnpj: cnpj}, then=Value(nome)) for cnpj, nome in services.DE_PARA_CNPJ.items()]
+    return Case(*whens, default=F(col_nome), output_field=CharField()) if whens else F(col_nome)
+
+def transportadora_final():
+    """Transportadora_Final: emitente do primeiro CT-e da nota, senão a transportadora da NF-e."""
+    primeiro_cte = Cte.objects.filter(chave_nf=OuterRef('pk')).order_by('id').values('emitente')[:1]
+    return Coalesce(Subquery(primeiro_cte), F('transportadora'), Value('---'), output_field=CharField())
+
+def _q_data(parte, valores):
+    # Ano/Mes/Dia = 0 no DataFrame é nota sem data
+    numeros = [int(v) for v in valores if str(v).isdigit()]
+    q = Q(**{f"data__{parte}__in": [n for n in numeros if n]})
+    return q | Q(data__isnull=True) if 0 in numeros else q
+
+def _q_nome(valores, col_cnpj, col_nome):
+    # Filial conhecida é filtrada pelo CNPJ; as demais pelo nome (que não pode ser de CNPJ apelidado)
+    apelidados = [c for c, nome in services.DE_PARA_CNPJ.items() if nome in valores]
+    return Q(**{f"{col_cnpj}__in": apelidados}) | (Q(**{f"{col_nome}__in": valores}) & ~Q(**{f"{col_cnpj}__in": list(services.DE_PARA_CNPJ)}))
+
+def _q_frete(valores):
+    mapa = {'CIF': Q(mod_frete='0'), 'FOB': Q(mod_frete='1'), 'Outros': ~Q(mod_frete__in=['0', '1'])}
+    return reduce(operator.or_, [mapa.get(v, NENHUMA) for v in valores], NENHUMA)
+
+def _q_operacao(valores):
+    emit = Q(cnpj_emit__in=list(services.MEUS_CNPJS)); dest = Q(cnpj_dest__in=list(services.MEUS_CNPJS))
+    mapa = {'Transferência': emit & dest, 'Venda': emit & ~dest, 'Compra': ~emit & dest, 'Outros': ~emit & ~dest}
+    return reduce(operator.or_, [mapa.get(v, NENHUMA) for v in valores], NENHUMA)
+
+def notas_filtradas(filtros):
+    """QuerySet de Nfe com os mesmos filtros que as views aplicavam no DataFrame."""
+    qs = Nfe.objects.all()
+    if filtros.get('ano'): qs = qs.filter(_q_data('year', filtros['ano']))
+    if filtros.get('mes'): qs = qs.filter(_q_data('month', filtros['mes']))
+    if filtros.get('dia'): qs = qs.filter(_q_data('day', filtros['dia']))
+    if filtros.get('filial'): qs = qs.filter(_q_nome(filtros['filial'], 'cnpj_emit', 'emitente'))
+    if filtros.get('cliente'): qs = qs.filter(_q_nome(filtros['cliente'], 'cnpj_dest', 'destinatario'))
+    if filtros.get('mod_frete'): qs = qs.filter(_q_frete(filtros['mod_frete']))
+    if filtros.get('tipo_op'): qs = qs.filter(_q_operacao(filtros['tipo_op']))
+    if filtros.get('transp'): qs = qs.annotate(transp_final=transportadora_final()).filter(transp_final__in=filtros['transp'])
+    if filtros.get('numero_nf'): qs = qs.filter(numero_nf=filtros['numero_nf'])
+    if filtros.get('numero_cte'):
+        # Mesmo "contém" da máscara (sobre os CT-es não complementares da nota), como subquery
+        ctes = Cte.objects.filter(chave_nf=OuterRef('pk'), numero_cte__contains=filtros['numero_cte']).exclude(tp_cte='1')
+        qs = qs.filter(Exists(ctes))
+    return qs
+
+# ==============================================================================
+# AGREGAÇÕES NO BANCO
+# ==============================================================================
+def kpis_banco(qs):
+    """Totais que não dependem do rateio: valor, peso e quantidade de notas."""
+    tot = qs.aggregate(v_nf=Sum('valor_nf'), v_peso=Sum('peso_bruto'), viagens=Count('pk'))
+    return float(tot['v_nf'] or 0), float(tot['v_peso'] or 0), tot['viagens']
+
+def fatia(filtros):
+    """
+    DataFrame só com as notas da fatia (mesmas colunas do get_dashboard_data)
+    e o QuerySet que a gerou, para as agregações no banco.
+    """
+    qs = notas_filtradas(filtros)
+    df = services.montar_notas(qs.values_list('chave_nf', flat=True).iterator(chunk_size=10000))
+    return qs, df
+
+# ==============================================================================
+# CUBO DIÁRIO (ResumoDiario)
+# ==============================================================================
+def resumo_filtrado(filtros):
+    """QuerySet do cubo com os filtros da tela (os de texto da análise não existem no cubo)."""
+    qs = ResumoDiario.objects.all()
+    if filtros.get('ano'): qs = qs.filter(_q_data('year', filtros['ano']))
+    if filtros.get('mes'): qs = qs.filter(_q_data('month', filtros['mes']))
+    if filtros.get('dia'): qs = qs.filter(_q_data('day', filtros['dia']))
+    if filtros.get('filial'): qs = qs.filter(emitente_legivel__in=filtros['filial'])
+    if filtros.get('cliente'): qs = qs.filter(destinatario_legivel__in=filtros['cliente'])
+    if filtros.get('transp'): qs = qs.filter(transportadora_final__in=filtros['transp'])
+    if filtros.get('mod_frete'): qs = qs.filter(frete_tipo__in=filtros['mod_frete'])
+    if filtros.get('tipo_op'): qs = qs.filter(operacao__in=filtros['tipo_op'])
+    return qs
+
+def resumo(filtros):
+    """Linhas do cubo que passam nos filtros, com os nomes de coluna do DataFrame do dashboard."""
+    qs = resumo_filtrado(filtros)
+    campos = list(services.DIMENSOES_RESUMO.values()) + list(services.METRICAS_RESUMO) + ['qtd_notas']
+    df = pd.DataFrame(list(qs.values_list(*campos)), columns=campos)
+    return df.rename(columns={campo: col for col, campo in services.DIMENSOES_RESUMO.items()})
+
+# ==============================================================================
+# ÍNDICE DAS OPÇÕES DOS FILTROS (DO CUBO)
+# ==============================================================================
+# Filtro da tela -> (chave em opts no template, expressão no ResumoDiario)
+FACETAS = {
+    'ano': ('ano', ExtractYear('data')), 'mes': ('mes', ExtractMonth('data')), 'dia': ('dia', ExtractDay('data')),
+    'filial': ('filial', F('emitente_legivel')), 'cliente': ('cliente', F('destinatario_legivel')),
+    'transp': ('transp', F('transportadora_final')), 'mod_frete': ('mod', F('frete_tipo')), 'tipo_op': ('tipo', F('operacao')),
+}
+
+def chave_filtros(filtros):
+    """Mesma chave para a mesma seleção, independente da ordem dos valores e dos filtros vazios."""
+    normal = {k: sorted(str(x) for x in v) if isinstance(v, list) else v for k, v in sorted(filtros.items()) if v}
+    return hashlib.sha1(json.dumps(normal, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _expressao_nfe(filtro):
+    """A dimensão do cubo calculada direto no Nfe, para quando o cubo ainda não foi montado."""
+    if filtro in ('ano', 'mes', 'dia'): return FACETAS[filtro][1]
+    if filtro == 'filial': return nome_legivel('cnpj_emit', 'emitente')
+    if filtro == 'cliente': return nome_legivel('cnpj_dest', 'destinatario')
+    if filtro == 'transp': return transportadora_final()
+    if filtro == 'mod_frete':
+        return Case(When(mod_frete='0', then=Value('CIF')), When(mod_frete='1', then=Value('FOB')),
+                    default=Value('Outros'), output_field=CharField())
+    emit = Q(cnpj_emit__in=list(services.MEUS_CNPJS)); dest = Q(cnpj_dest__in=list(services.MEUS_CNPJS))
+    return Case(When(emit & dest, then=Value('Transferência')), When(emit, then=Value('Venda')),
+                When(dest, then=Value('Compra')), default=Value('Outros'), output_field=CharField())
+
+def _faceta(filtros, filtro, expr, cubo=True):
+    # Valores da dimensão com os filtros das outras: os meses do ano escolhido, as filiais do cliente etc.
+    outros = {k: v for k, v in filtros.items() if k != filtro}
+    if cubo: linhas = resumo_filtrado(outros).annotate(valor=expr).values('valor').annotate(qtd=Sum('qtd_notas')).order_by()
+    else: linhas = notas_filtradas(outros).annotate(valor=_expressao_nfe(filtro)).values('valor').annotate(qtd=Count('pk')).order_by()
+    contagem = {}
+    for r in linhas:
+        valor = r['valor']
+        if filtro in ('ano', 'mes', 'dia'): valor = valor or 0  # Ano/Mes/Dia = 0 é nota sem data
+        elif valor is None: continue
+        contagem[valor] = contagem.get(valor, 0) + (r['qtd'] or 0)
+    # O que está selecionado continua na lista (com 0) mesmo que os outros filtros o excluam
+    for v in filtros.get(filtro) or []:
+        if filtro in ('ano', 'mes', 'dia'):
+            if not str(v).isdigit(): continue
+            v = int(v)
+        contagem.setdefault(v, 0)
+    return sorted(contagem.items(), key=lambda x: x[0], reverse=filtro == 'ano')
+
+def opcoes(filtros):
+    """
+    Opções dos filtros com a quantidade de notas de cada uma, no formato
+    {'ano': [(2026, 1234), ...], 'mes': ..., ...}. Saem do cubo diário (um
+    GROUP BY por dimensão, sem ler notas nem o DataFrame) e ficam no cache
+    sob a versão publicada dos dados e a seleção: o índice completo
+    (sem filtros) é montado uma vez por versão e as facetas dependentes uma
+    vez por combinação de filtros. Com o cubo ainda vazio os GROUP BY vão
+    direto no Nfe: as opções nunca disparam a montagem do histórico.
+    """
+    filtros = {k: filtros.get(k) or [] for k in FACETAS}
+    versao = snapshot.versao_publicada()
+    chave = f"opcoes:{versao}:{chave_filtros(filtros)}"
+    if versao:
+        prontas = cache.get(chave)
+        if prontas is not None: return prontas
+    cubo = ResumoDiario.objects.exists()
+    prontas = {nome: _faceta(filtros, filtro, expr, cubo) for filtro, (nome, expr) in FACETAS.items()}
+    if versao: cache.set(chave, prontas, settings.DASHBOARD_SNAPSHOT_TTL)
+    return prontas
+
+# ==============================================================================
+# PAGINAÇÃO DA TABELA DA ANÁLISE (KEYSET)
+# ==============================================================================
+COLUNAS_ORDENAVEIS = (
+    'data', 'numero_cte', 'cte_complementar', 'numero_nf', 'cidade_origem', 'cidade_destino', 'Destinatario_Legivel',
+    'valor_nf', 'peso_bruto', 'peso_cte_total', 'frete_valor', 'Frete_Tipo', 'Operacao',
+)
+SAL_CURSOR = 'core.analise.cursor'
+
+def _chave_ordem(serie):
+    # Valores comparáveis e serializáveis no cursor; vazios ficam no começo da ordem crescente
+    if pd.api.types.is_datetime64_any_dtype(serie): return serie.to_numpy().view('int64')  # NaT = menor int64
+    if pd.api.types.is_numeric_dtype(serie): return serie.astype('float64').fillna(-np.inf).to_numpy()
+    return serie.astype('str').fillna('').to_numpy(dtype=object)
+
+def gerar_cursor(ordem, desc, valor, chave_nf):
+    return signing.dumps([ordem, desc, valor, chave_nf], salt=SAL_CURSOR, compress=True)
+
+def ler_cursor(texto, ordem, desc):
+    """(valor, chave_nf) do cursor, ou None se ele faltar, for inválido ou de outra ordenação."""
+    if not texto: return None
+    try: c_ordem, c_desc, valor, chave_nf = signing.loads(texto, salt=SAL_CURSOR)
+    except (signing.BadSignature, ValueError, TypeError): return None
+    return (valor, chave_nf) if (c_ordem, c_desc) == (ordem, desc) else None
+
+def pagina(df, m, ordem='data', desc=True, cursor=None, tamanho=50):
+    """
+    Uma página das linhas de df marcadas em m, ordenadas por (ordem, chave_nf):
+    devolve os rótulos das linhas da página e o cursor da próxima (None na
+    última). O cursor guarda a posição da última linha entregue, não um
+    offset, então a próxima página continua exatamente dali.
+    """
+    chaves = pd.DataFrame({'k': _chave_ordem(df[ordem]), 'c': df['chave_nf'].to_numpy()}, index=df.index)[m]
+    if cursor is not None:
+        valor, chave_nf = cursor
+        if desc: depois = (chaves['k'] < valor) | ((chaves['k'] == valor) & (chaves['c'] < chave_nf))
+        else: depois = (chaves['k'] > valor) | ((chaves['k'] == valor) & (chaves['c'] > chave_nf))
+        chaves = chaves[depois.to_numpy(dtype=bool)]
+    topo = chaves.sort_values(['k', 'c'], ascending=not desc).iloc[:tamanho + 1]
+    if len(topo) <= tamanho: return list(topo.index), None
+    ultima = topo.iloc[tamanho - 1]
+    valor = ultima['k'].item() if hasattr(ultima['k'], 'item') else ultima['k']
+    return list(topo.index[:tamanho]), gerar_cursor(ordem, desc, valor, ultima['c'])
@@ -0,0 +1,181 @@
+# corpus.py
+# Gerador de NF-e/CT-e sintéticos (mas com a mesma estrutura dos XMLs reais)
+# para medir a velocidade da importação sem precisar de dados de cliente.
+import io
+import os
+import random
+import zipfile
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+from .config import CNPJS_CIA
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+NS_CTE = 'http://www.portalfiscal.inf.br/cte'
+
+CODIGOS_UF = {'SP': '35', 'DF': '53', 'ES': '32', 'PE': '26', 'CE': '23', 'GO': '52', 'MG': '31', 'PI': '22',
+              'MA': '21', 'MS': '50', 'RJ': '33', 'BA': '29', 'MT': '51', 'PA': '15', 'PR': '41', 'RS': '43'}
+CIDADES = [('Sao Paulo', 'SP', '01310100'), ('Brasilia', 'DF', '70040010'), ('Goiania', 'GO', '74000000'),
+           ('Belo Horizonte', 'MG', '30130000'), ('Recife', 'PE', '50030000'), ('Fortaleza', 'CE', '60000000'),
+           ('Salvador', 'BA', '40000000'), ('Curitiba', 'PR', '80000000'), ('Porto Alegre', 'RS', '90000000'),
+           ('Campo Grande', 'MS', '79000000'), ('Cuiaba', 'MT', '78000000'), ('Belem', 'PA', '66000000'),
+           ('Rio de Janeiro', 'RJ', '20000000'), ('Vitoria', 'ES', '29000000'), ('Teresina', 'PI', '64000000')]
+PRODUTOS = ['BISCOITO RECHEADO 140G/48UN', 'MACARRAO ESPAGUETE 500G', 'FARINHA DE TRIGO 5KG', 'CAFE TORRADO 12X500G',
+            'ACUCAR CRISTAL 10 X 1KG', 'OLEO DE SOJA 900ML', 'ARROZ TIPO 1 5KG', 'BOLACHA AGUA E SAL 400G',
+            'MISTURA PARA BOLO 450G', 'MARGARINA 500G', 'FEIJAO CARIOCA 1KG', 'CAIXA EMBARQUE 005/09FD']
+TRANSPORTADORAS = [('11222333000144', 'TRANSPORTES RAPIDO LTDA'), ('22333444000155', 'LOGISTICA CENTRO OESTE SA'),
+                   ('33444555000166', 'EXPRESSO NORDESTE LTDA'), ('44555666000177', 'RODOVIARIO SUL TRANSPORTES')]
+
+
+def dv_chave(base43):
+    """Dígito verificador (módulo 11) da chave de acesso."""
+    soma, peso = 0, 2
+    for d in reversed(base43):
+        soma += int(d) * peso
+        peso = 2 if peso == 9 else peso + 1
+    resto = soma % 11
+    return '0' if resto < 2 else str(11 - resto)
+
+
+def gerar_chave(uf, dt, cnpj, modelo, numero, serie=1):
+    base = f"{CODIGOS_UF.get(uf, '35')}{dt:%y%m}{cnpj:0>14}{modelo}{serie:03d}{numero:09d}1{numero % 10**8:08d}"
+    return base + dv_chave(base)
+
+
+def _cliente(rng):
+    cidade, uf, cep = rng.choice(CIDADES)
+    n = rng.randint(1, 5000)
+    return {'cnpj': f"{10000000 + n:08d}0001{n % 100:02d}", 'nome': f"CLIENTE {n} COMERCIO LTDA",
+            'cidade': cidade, 'uf': uf, 'cep': cep, 'lgr': f"RUA {n % 300}", 'nro': str(n % 999), 'bairro': 'CENTRO'}
+
+
+def gerar_nfe(numero, n_itens, rng, dt=None):
+    """Devolve (chave, xml_bytes) de um nfeProc com `n_itens` <det>, <transp>/<vol> e <ICMSTot>."""
+    dt = dt or date(2026, 1, 1) + timedelta(days=rng.randint(0, 364))
+    cnpj_emit = rng.choice(list(CNPJS_CIA))
+    cidade_emit, uf_emit, cep_emit = rng.choice(CIDADES)
+    dest = _cliente(rng)
+    # ~10% das notas são transferências entre filiais
+    if rng.random() < 0.1:
+        dest['cnpj'] = rng.choice(list(CNPJS_CIA)); dest['nome'] = 'FILIAL'
+    chave = gerar_chave(uf_emit, dt, cnpj_emit, '55', numero)
+
+    dets, v_total, peso = [], 0.0, 0.0
+    for i in range(n_itens):
+        qtd = rng.randint(1, 200)
+        v_unit = round(rng.uniform(5, 300), 2)
+        v_prod = round(qtd * v_unit, 2)
+        v_total += v_prod
+        peso += qtd * rng.uniform(0.5, 20)
+        dets.append(
+            f'<det nItem="{i + 1}"><prod><cProd>{1000 + i}</cProd><cEAN>SEM GTIN</cEAN>'
+            f'<xProd>{escape(rng.choice(PRODUTOS))}</xProd><NCM>19053100</NCM><CFOP>{rng.choice(["5102", "6102", "5152"])}</CFOP>'
+            f'<uCom>CX</uCom><qCom>{qtd}.0000</qCom><vUnCom>{v_unit:.10f}</vUnCom><vProd>{v_prod:.2f}</vProd></prod>'
+            f'<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>{v_prod:.2f}</vBC><pICMS>12.00</pICMS>'
+            f'<vICMS>{v_prod * 0.12:.2f}</vICMS></ICMS00></ICMS></imposto></det>'
+        )
+    cnpj_t, nome_t = rng.choice(TRANSPORTADORAS)
+    cidade_t, uf_t, _ = rng.choice(CIDADES)
+    vols = ''.join(f'<vol><qVol>{rng.randint(1, 50)}</qVol><esp>CAIXA</esp><pesoL>{peso / 2 * 0.95:.3f}</pesoL>'
+                   f'<pesoB>{peso / 2:.3f}</pesoB></vol>' for _ in range(2))
+
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe xmlns="{NS_NFE}">'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><cUF>{chave[:2]}</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>{numero}</nNF>'
+        f'<dhEmi>{dt:%Y-%m-%d}T08:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{cnpj_emit}</CNPJ><xNome>EMPRESA ALIMENTOS SA</xNome><enderEmit><xLgr>AV INDUSTRIAL</xLgr>'
+        f'<nro>100</nro><xBairro>DISTRITO</xBairro><xMun>{cidade_emit}</xMun><UF>{uf_emit}</UF><CEP>{cep_emit}</CEP>'
+        f'</enderEmit></emit>'
+        f'<dest><CNPJ>{dest["cnpj"]}</CNPJ><xNome>{dest["nome"]}</xNome><enderDest><xLgr>{dest["lgr"]}</xLgr>'
+        f'<nro>{dest["nro"]}</nro><xBairro>{dest["bairro"]}</xBairro><xMun>{dest["cidade"]}</xMun><UF>{dest["uf"]}</UF>'
+        f'<CEP>{dest["cep"]}</CEP></enderDest></dest>'
+        f'{"".join(dets)}'
+        f'<total><ICMSTot><vBC>{v_total:.2f}</vBC><vICMS>{v_total * 0.12:.2f}</vICMS><vProd>{v_total:.2f}</vProd>'
+        f'<vNF>{v_total:.2f}</vNF></ICMSTot></total>'
+        f'<transp><modFrete>{rng.choice("0019")}</modFrete><transporta><CNPJ>{cnpj_t}</CNPJ><xNome>{nome_t}</xNome>'
+        f'<xEnder>ROD BR 060 KM {rng.randint(1, 500)}</xEnder><xMun>{cidade_t}</xMun><UF>{uf_t}</UF></transporta>{vols}</transp>'
+        f'</infNFe></NFe><protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><cStat>100</cStat></infProt></protNFe>'
+        f'</nfeProc>'
+    )
+    return chave, xml.encode('utf-8')
+
+
+def gerar_cte(numero, chaves_nf, rng, dt=None, complementar=False):
+    """Devolve (chave, xml_bytes) de um cteProc referenciando `chaves_nf` (vários <infNFe>) com pedágio."""
+    dt = dt or date(2026, 1, 1) + timedelta(days=rng.randint(0, 364))
+    cnpj_t, nome_t = rng.choice(TRANSPORTADORAS)
+    cidade_ini, uf_ini, cep_ini = rng.choice(CIDADES)
+    dest = _cliente(rng)
+    chave = gerar_chave(uf_ini, dt, cnpj_t, '57', numero)
+
+    frete_peso = round(rng.uniform(200, 8000), 2)
+    pedagio = round(rng.uniform(0, 300), 2)
+    comps = (f'<Comp><xNome>FRETE PESO</xNome><vComp>{frete_peso:.2f}</vComp></Comp>'
+             f'<Comp><xNome>PEDAGIO</xNome><vComp>{pedagio:.2f}</vComp></Comp>'
+             f'<Comp><xNome>GRIS</xNome><vComp>12.50</vComp></Comp>')
+    total = frete_peso + pedagio + 12.50
+    nfs = ''.join(f'<infNFe><chave>{k}</chave></infNFe>' for k in chaves_nf)
+    if complementar:
+        corpo = f'<infCteComp><chCTe>{gerar_chave(uf_ini, dt, cnpj_t, "57", numero + 1)}</chCTe></infCteComp>'
+    else:
+        corpo = (f'<infCTeNorm><infCarga><vCarga>{rng.uniform(1000, 90000):.2f}</vCarga><proPred>ALIMENTOS</proPred>'
+                 f'<infQ><cUnid>01</cUnid><tpMed>PESO BRUTO</tpMed><qCarga>{rng.uniform(100, 20000):.4f}</qCarga></infQ>'
+                 f'<infQ><cUnid>03</cUnid><tpMed>VOLUMES</tpMed><qCarga>{rng.randint(1, 500)}.0000</qCarga></infQ>'
+                 f'</infCarga><infDoc>{nfs}</infDoc></infCTeNorm>')
+
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?><cteProc xmlns="{NS_CTE}" versao="4.00"><CTe xmlns="{NS_CTE}">'
+        f'<infCte Id="CTe{chave}" versao="4.00">'
+        f'<ide><cUF>{chave[:2]}</cUF><CFOP>6353</CFOP><mod>57</mod><serie>1</serie><nCT>{numero}</nCT>'
+        f'<dhEmi>{dt:%Y-%m-%d}T10:00:00-03:00</dhEmi><tpCTe>{1 if complementar else 0}</tpCTe>'
+        f'<xMunIni>{cidade_ini}</xMunIni><UFIni>{uf_ini}</UFIni><xMunFim>{dest["cidade"]}</xMunFim><UFFim>{dest["uf"]}</UFFim></ide>'
+        f'<emit><CNPJ>{cnpj_t}</CNPJ><xNome>{nome_t}</xNome><enderEmit><xLgr>ROD BR 060</xLgr><nro>S/N</nro>'
+        f'<xMun>{cidade_ini}</xMun><CEP>{cep_ini}</CEP><UF>{uf_ini}</UF></enderEmit></emit>'
+        f'<rem><CNPJ>{rng.choice(list(CNPJS_CIA))}</CNPJ><xNome>EMPRESA ALIMENTOS SA</xNome></rem>'
+        f'<dest><CNPJ>{dest["cnpj"]}</CNPJ><xNome>{dest["nome"]}</xNome><enderDest><xLgr>{dest["lgr"]}</xLgr>'
+        f'<nro>{dest["nro"]}</nro><xMun>{dest["cidade"]}</xMun><UF>{dest["uf"]}</UF></enderDest></dest>'
+        f'<vPrest><vTPrest>{total:.2f}</vTPrest><vRec>{total:.2f}</vRec>{comps}</vPrest>'
+        f'{corpo}</infCte></CTe><protCTe versao="4.00"><infProt><chCTe>{chave}</chCTe><cStat>100</cStat></infProt></protCTe>'
+        f'</cteProc>'
+    )
+    return chave, xml.encode('utf-8')
+
+
+def gerar_documentos(qtd_nfe, itens_por_nfe=20, nfs_por_cte=3, seed=42):
+    """
+    Gera o corpus em memória: (nfes, ctes), listas de (nome_arquivo, xml_bytes).
+    Os CT-es referenciam as chaves das NF-es geradas, então o rateio do frete
+    tem dado real para trabalhar. 1 em cada 20 CT-es é complementar.
+    """
+    rng = random.Random(seed)
+    nfes, chaves = [], []
+    for n in range(1, qtd_nfe + 1):
+        chave, xml = gerar_nfe(n, max(1, int(rng.gauss(itens_por_nfe, itens_por_nfe / 4))), rng)
+        nfes.append((f"{chave}-nfe.xml", xml)); chaves.append(chave)
+
+    ctes = []
+    for n, i in enumerate(range(0, len(chaves), nfs_por_cte), start=1):
+        chave, xml = gerar_cte(n, chaves[i:i + nfs_por_cte], rng, complementar=(n % 20 == 0))
+        ctes.append((f"{chave}-cte.xml", xml))
+    return nfes, ctes
+
+
+def gravar_zips(documentos, pasta, prefixo, docs_por_zip=5000):
+    """Empacota os documentos em ZIPs de até `docs_por_zip` XMLs. Devolve os caminhos criados."""
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = []
+    for parte, i in enumerate(range(0, len(documentos), docs_por_zip), start=1):
+        caminho = os.path.join(pasta, f"{prefixo}_{parte:03d}.zip")
+        with zipfile.ZipFile(caminho, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for nome, xml in documentos[i:i + docs_por_zip]: zf.writestr(nome, xml)
+        caminhos.append(caminho)
+    return caminhos
+
+
+def zip_em_memoria(documentos):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for nome, xml in documentos: zf.writestr(nome, xml)
+    buf.seek(0)
+    buf.name = 'corpus.zip'
+    return buf
@@ -0,0 +1,154 @@
+# graficos.py
+# Gráficos do dashboard (Plotly) e o cache dos fragmentos já renderizados.
+# Cada gráfico é servido como JSON (figura + config) pelo /api/chart/<nome>/
+# e desenhado no navegador com Plotly.newPlot. O JSON fica no cache
+# 'graficos' (LRU; Redis dividido entre os workers ou memória do processo,
+# ver CACHES no settings) sob a versão dos dados + os filtros normalizados: a
+# mesma combinação de filtros pedida de novo, por qualquer usuário, não monta
+# nem serializa a figura outra vez. Uma importação publica uma versão nova do
+# snapshot, a chave muda e as entradas antigas saem pelo LRU.
+import json
+import pandas as pd
+import plotly.express as px
+import plotly.offline
+from django.core.cache import caches
+from . import consultas, utils
+
+LAYOUT_COMUM = {'template': 'plotly_white', 'margin': dict(l=10, r=10, t=30, b=10), 'height': 300}
+CONFIG_PLOT = {'displayModeBar': True, 'scrollZoom': True, 'responsive': True}
+
+C_VOL = '#0d6efd'; C_CUS = '#dc3545'; C_EFF = '#198754'
+# nome -> (coluna do agrupamento, métrica ou None para R$/ton, título, cor)
+TOP10 = {
+    'cli_vol': ('Destinatario_Legivel', 'peso_bruto', 'Top Clientes: Volume', C_VOL),
+    'cli_cst': ('Destinatario_Legivel', 'frete_valor', 'Top Clientes: Custo Frete', C_CUS),
+    'cli_rst': ('Destinatario_Legivel', None, 'Top Clientes: R$/Ton', C_EFF),
+    'fil_vol': ('Emitente_Legivel', 'peso_bruto', 'Top Filiais: Volume', C_VOL),
+    'fil_cst': ('Emitente_Legivel', 'frete_valor', 'Top Filiais: Custo Frete', C_CUS),
+    'fil_rst': ('Emitente_Legivel', None, 'Top Filiais: R$/Ton', C_EFF),
+    'cid_vol': ('cidade_destino', 'peso_bruto', 'Top Cidades: Volume', C_VOL),
+    'cid_cst': ('cidade_destino', 'frete_valor', 'Top Cidades: Custo Frete', C_CUS),
+    'cid_rst': ('cidade_destino', None, 'Top Cidades: R$/Ton', C_EFF),
+}
+GRAFICOS = ('map', 'ped') + tuple(TOP10)
+URL_PLOTLYJS = f"https://cdn.plot.ly/plotly-{plotly.offline.get_plotlyjs_version()}.min.js"
+
+# ==============================================================================
+# FIGURAS
+# ==============================================================================
+def mapa(notas):
+    """Mapa de distribuição a partir das notas filtradas (coordenada do cliente, senão a da UF)."""
+    df_map = notas.copy(deep=False)  # as colunas lat/lon_final não vazam para quem passou as notas
+
+    def get_lat_fallback(row):
+        if pd.notnull(row.get('latitude')) and row.get('latitude') != 0:
+            return row['latitude']
+        return utils.COORDS_UF.get(row['UF_Dest'], (0,0))[0]
+
+    def get_lon_fallback(row):
+        if pd.notnull(row.get('longitude')) and row.get('longitude') != 0:
+            return row['longitude']
+        return utils.COORDS_UF.get(row['UF_Dest'], (0,0))[1]
+
+    df_map['lat_final'] = df_map.apply(get_lat_fallback, axis=1)
+    df_map['lon_final'] = df_map.apply(get_lon_fallback, axis=1)
+
+    agg_map = df_map.groupby(['lat_final', 'lon_final', 'cidade_destino', 'UF_Dest'], observed=True).agg({
+        'peso_bruto': 'sum',
+        'frete_valor': 'sum',
+        'valor_nf': 'sum',
+        'pedagio_valor': 'sum',
+        'chave_nf': 'count',
+        'distancia_km': 'mean'
+    }).reset_index()
+
+    agg_map['custo_ton'] = agg_map.apply(lambda x: x['frete_valor'] / (x['peso_bruto']/1000) if x['peso_bruto']>0 else 0, axis=1)
+    agg_map['perc_frete'] = agg_map.apply(lambda x: (x['frete_valor'] / x['valor_nf'] * 100) if x['valor_nf']>0 else 0, axis=1)
+    agg_map['txt_peso'] = agg_map['peso_bruto'].apply(utils.br_weight)
+    agg_map['txt_frete'] = agg_map['frete_valor'].apply(utils.br_money)
+    agg_map['txt_pedagio'] = agg_map['pedagio_valor'].apply(utils.br_money)
+    agg_map['txt_ton'] = agg_map['custo_ton'].apply(lambda x: f"R$ {x:,.2f}".replace('.',','))
+    agg_map['txt_perc'] = agg_map['perc_frete'].apply(lambda x: f"{x:,.2f}%".replace('.',','))
+    agg_map['txt_dist'] = agg_map['distancia_km'].apply(lambda x: f"{x:,.1f} km".replace('.',','))
+
+    agg_map = agg_map[(agg_map['lat_final'] != 0) & (agg_map['lon_final'] != 0)]
+
+    center_lat = agg_map['lat_final'].mean() if not agg_map.empty else -15.79
+    center_lon = agg_map['lon_final'].mean() if not agg_map.empty else -47.89
+
+    start_zoom = 4
+    if not agg_map.empty:
+        lat_span = agg_map['lat_final'].max() - agg_map['lat_final'].min()
+        if lat_span < 2: start_zoom = 9
+        elif lat_span < 10: start_zoom = 6
+
+    fig_map = px.scatter_mapbox(
+        agg_map,
+        lat='lat_final', lon='lon_final', size='peso_bruto', color='frete_valor',
+        hover_name='cidade_destino',
+        hover_data={
+            'lat_final': False, 'lon_final': False, 'peso_bruto': False, 'frete_valor': False,
+            'chave_nf': True, 'txt_peso': True, 'txt_frete': True,
+            'txt_ton': True, 'txt_perc': True, 'txt_pedagio': True, 'txt_dist': True
+        },
+        labels={'chave_nf': 'Qtd NFs', 'txt_peso': 'Peso Bruto', 'txt_frete': 'Valor Frete', 'txt_ton': 'Custo/Ton', 'txt_perc': 'Frete %', 'txt_pedagio': 'Pedágio', 'txt_dist': 'Distância'},
+        zoom=start_zoom, center=dict(lat=center_lat, lon=center_lon),
+        mapbox_style="carto-positron", title="Mapa de Distribuição (Localização Real)"
+    )
+    fig_map.update_layout(margin=dict(l=0, r=0, t=30, b=0), height=400)
+    return fig_map
+
+def pedagio(cubo):
+    agg_ped = cubo.groupby('UF_Dest')['pedagio_valor'].sum().reset_index().sort_values('pedagio_valor', ascending=False)
+    fig_ped = px.bar(agg_ped, x='UF_Dest', y='pedagio_valor', title="Custo de Pedágio por UF", text_auto='.2s')
+    fig_ped.update_layout(**LAYOUT_COMUM); fig_ped.update_traces(marker_color='#fd7e14')
+    return fig_ped
+
+def top10(cubo, nome):
+    groupby_col, metric_col, title, color = TOP10[nome]
+    if metric_col is None:
+        temp = cubo.groupby(groupby_col).agg({'frete_valor':'sum', 'peso_bruto':'sum'}).reset_index()
+        temp['rs_ton'] = temp.apply(lambda x: x['frete_valor'] / (x['peso_bruto']/1000) if x['peso_bruto']>0 else 0, axis=1)
+        temp = temp.sort_values('rs_ton', ascending=False).head(10)
+        y_val = 'rs_ton'
+    else:
+        temp = cubo.groupby(groupby_col)[metric_col].sum().reset_index().sort_values(metric_col, ascending=False).head(10)
+        y_val = metric_col
+
+    temp['label'] = temp[groupby_col].astype(str).apply(lambda x: x[:20] + '...' if len(x)>20 else x)
+    fig = px.bar(temp, x=y_val, y='label', orientation='h', title=title, text_auto='.2s')
+    fig.update_traces(marker_color=color, hovertemplate=f"<b>%{{y}}</b><br>Valor: %{{x}}<br>Nome: %{{customdata}}", customdata=temp[groupby_col])
+    fig.update_layout(yaxis={'categoryorder':'total ascending', 'title': None}, **LAYOUT_COMUM)
+    return fig
+
+# ==============================================================================
+# CACHE DOS FRAGMENTOS
+# ==============================================================================
+def chave(nome, filtros, versao):
+    """Chave do gráfico no cache (e ETag da resposta)."""
+    return f"{versao}:{consultas.chave_filtros(filtros)}:{nome}"
+
+def renderizar(nomes, filtros, versao, cubo, notas):
+    """
+    JSON ({"figura": ..., "config": ...}) dos gráficos pedidos, do cache
+    quando possível. cubo e notas são funções que devolvem o ResumoDiario e
+    as notas já filtrados; só são chamadas para montar o que faltar no cache
+    (e notas só pelo mapa). Sem versão publicada (snapshot ausente ou
+    vencido) não usa o cache.
+    """
+    cache = caches['graficos']
+    chaves = {nome: chave(nome, filtros, versao) for nome in nomes}
+    prontos = cache.get_many(list(chaves.values())) if versao else {}
+    saida, novos = {}, {}
+    for nome, k in chaves.items():
+        if k in prontos:
+            saida[nome] = prontos[k]; continue
+        if nome == 'map': fig = mapa(notas())
+        elif nome == 'ped': fig = pedagio(cubo())
+        else: fig = top10(cubo(), nome)
+        saida[nome] = novos[k] = f'{{"figura": {fig.to_json()}, "config": {json.dumps(CONFIG_PLOT)}}}'
+    if versao and novos: cache.set_many(novos)
+    return saida
+
+def limpar():
+    caches['graficos'].clear()
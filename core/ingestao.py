@@ -0,0 +1,143 @@
+# ingestao.py
+# Parse dos XMLs fora do banco. Este módulo NÃO importa models: as funções
+# daqui rodam dentro dos processos do pool (inclusive com spawn no Windows).
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from . import parsers
+
+# ZIP dentro de ZIP é copiado para um arquivo temporário; até este tamanho fica em RAM
+SPOOL_ZIP_MAX_MEMORIA = 32 * 1024 * 1024
+
+# ==============================================================================
+# PARSE DE UM DOCUMENTO (PURO, SEM BANCO)
+# ==============================================================================
+def parse_documento(content, fname, tipo):
+    try:
+        if tipo == 'cte':
+            rows, err = parsers.parse_cte(content, fname)
+            return {'arquivo': fname, 'tipo': tipo, 'rows': rows, 'erro': err}
+        elif tipo == 'nfe':
+            header, items, err = parsers.parse_nfe(content, fname)
+            return {'arquivo': fname, 'tipo': tipo, 'header': header, 'items': items, 'erro': err}
+        return {'arquivo': fname, 'tipo': tipo, 'erro_fatal': f"Tipo de documento desconhecido: {tipo}"}
+    except Exception as e:
+        return {'arquivo': fname, 'tipo': tipo, 'erro_fatal': str(e)}
+
+def _parse_lote(tipo, lote):
+    resultados = []
+    for fname, content, erro in lote:
+        if erro:
+            resultados.append({'arquivo': fname, 'tipo': tipo, 'erro_arquivo': erro})
+            continue
+        t0 = time.perf_counter()
+        res = parse_documento(content, fname, tipo)
+        res['tempo_parse'] = time.perf_counter() - t0
+        resultados.append(res)
+    return resultados
+
+def _em_lotes(documentos, tamanho):
+    lote = []
+    for doc in documentos:
+        lote.append(doc)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote: yield lote
+
+# ==============================================================================
+# PARSE EM PARALELO (ProcessPool) MANTENDO A ORDEM DOS ARQUIVOS
+# ==============================================================================
+def parsear_documentos(documentos, tipo, workers=0, tamanho_lote=50):
+    """
+    Recebe tuplas (nome, conteúdo, erro) e devolve os resultados do parse
+    na mesma ordem de entrada. Com workers > 1 os lotes vão para um
+    ProcessPoolExecutor; no máximo 2 lotes por worker ficam em voo, para
+    não carregar o ZIP inteiro na memória de uma vez.
+    """
+    if workers <= 1:
+        for doc in documentos: yield from _parse_lote(tipo, [doc])
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        em_voo = deque()
+
+        def proximo():
+            lote, futuro = em_voo.popleft()
+            try: return futuro.result()
+            # Worker caiu (ex: falta de memória): refaz o lote aqui mesmo
+            except Exception: return _parse_lote(tipo, lote)
+
+        for lote in _em_lotes(documentos, tamanho_lote):
+            em_voo.append((lote, executor.submit(_parse_lote, tipo, lote)))
+            if len(em_voo) >= workers * 2: yield from proximo()
+        while em_voo: yield from proximo()
+
+# ==============================================================================
+# LEITURA EM STREAMING DOS ARQUIVOS ENVIADOS (XML, ZIP E ZIP DENTRO DE ZIP)
+# ==============================================================================
+def _membros_zip(zf, contagem, prefixo=''):
+    """
+    Lê um membro por vez do ZIP; nada além do XML atual fica em memória. O
+    nome gerado traz o caminho dos ZIPs aninhados (externo/interno.zip/nota.xml),
+    então membros de mesmo nome em ZIPs diferentes não se confundem.
+    """
+    membros = [i for i in zf.infolist() if not i.is_dir() and i.filename.lower().endswith(('.xml', '.zip'))]
+    contagem['total'] += sum(1 for i in membros if i.filename.lower().endswith('.xml'))
+    for info in membros:
+        try:
+            if info.filename.lower().endswith('.xml'):
+                with zf.open(info) as membro: yield f"{prefixo}{info.filename}", membro.read(), None
+                continue
+            # ZIP aninhado: copia em blocos para um spool (RAM até o limite, depois disco)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_ZIP_MAX_MEMORIA) as spool:
+                with zf.open(info) as membro: shutil.copyfileobj(membro, spool, 1024 * 1024)
+                spool.seek(0)
+                with zipfile.ZipFile(spool) as interno:
+                    yield from _membros_zip(interno, contagem, f"{prefixo}{info.filename}/")
+        except Exception as e:
+            if not info.filename.lower().endswith('.xml'): contagem['total'] += 1
+            yield f"{prefixo}{info.filename}", None, str(e)
+
+def iterar_documentos(arquivos, contagem):
+    """
+    Gera (nome, conteúdo, erro) para cada XML dos arquivos enviados, na ordem.
+    `contagem['total']` cresce à medida que cada ZIP é aberto, então a barra de
+    progresso não precisa de uma passada extra só para contar os XMLs.
+    """
+    for f in arquivos:
+        if hasattr(f, 'seek'): f.seek(0)
+        nome = os.path.basename(getattr(f, 'name', str(f)))
+        try:
+            if nome.lower().endswith('.zip'):
+                with zipfile.ZipFile(f) as zf:
+                    yield from _membros_zip(zf, contagem)
+            else:
+                contagem['total'] += 1
+                yield nome, f.read(), None
+        except Exception as e:
+            contagem['total'] += 1
+            yield nome, None, str(e)
+
+# ==============================================================================
+# PULA O QUE JÁ ESTÁ NO BANCO ANTES DO PARSE
+# ==============================================================================
+def pular_ja_importados(documentos, tipo, chaves_existentes, contagem):
+    """
+    Descarta documentos cuja chave já está em `chaves_existentes` (carregado uma
+    vez por upload). A checagem é O(1) e acontece antes do parse. Aqui nada entra
+    no conjunto: só o LoteImportacao.save_batch acrescenta as chaves que gravou,
+    então uma cópia que falhar no parse ou na gravação não derruba as seguintes.
+    Repetidos ainda em voo no mesmo upload saem no LoteImportacao.registrar.
+    """
+    contagem.setdefault('ignorados', 0)
+    for fname, content, erro in documentos:
+        chave = parsers.chave_rapida(content, fname, tipo) if not erro else ''
+        if chave and chave in chaves_existentes:
+            contagem['ignorados'] += 1
+            continue
+        yield fname, content, erro
@@ -0,0 +1,64 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core import services
+from core.models import Nfe, Cte, Cliente
+
+
+def cronometrar(func, repeticoes):
+    melhor = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        melhor = dt if melhor is None else min(melhor, dt)
+    return melhor
+
+
+def megas(df):
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara o DataFrame do dashboard bruto (todas as colunas, texto como string) com o tipado "
+        "(ESQUEMA_DASHBOARD): memória e tempo dos filtros isin e dos groupby que as views fazem."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=5, help="Rodadas por operação (vale a melhor)")
+        parser.add_argument('--colunas', action='store_true', help="Mostra a memória de cada coluna do DataFrame tipado")
+
+    def handle(self, *args, **opts):
+        nf_qs = list(Nfe.objects.all().values())
+        if not nf_qs: raise CommandError("Nenhuma NF-e no banco (importe XMLs ou use o gerar_corpus antes).")
+        cte_qs = list(Cte.objects.all().values())
+        clientes_qs = list(Cliente.objects.values(*services.CAMPOS_CLIENTE_DASH))
+
+        bruto = services.montar_dashboard_df(nf_qs, cte_qs, clientes_qs, tipar=False)
+        t0 = time.perf_counter()
+        tipado = services.tipar_dashboard(bruto)
+        t_tipar = time.perf_counter() - t0
+
+        m_bruto, m_tipado = megas(bruto), megas(tipado)
+        self.stdout.write(f"Notas: {len(tipado)} | tipagem em {t_tipar:.3f}s")
+        self.stdout.write(f"{'bruto':<8} {len(bruto.columns):3} colunas {m_bruto:10,.2f} MB")
+        self.stdout.write(f"{'tipado':<8} {len(tipado.columns):3} colunas {m_tipado:10,.2f} MB")
+        self.stdout.write(f"Redução: {m_bruto / m_tipado:.1f}x")
+
+        # Mesmas operações das views: filtros por transportadora/operação e top 10 por cliente
+        transps = list(tipado['Transportadora_Final'].dropna().unique()[:3])
+        operacoes = ['Venda', 'Transferência']
+        medidas = {
+            'isin Transportadora_Final': lambda df: df['Transportadora_Final'].isin(transps),
+            'isin Operacao': lambda df: df['Operacao'].isin(operacoes),
+            'groupby cliente (frete)': lambda df: df.groupby('Destinatario_Legivel')['frete_valor'].sum(),
+            'groupby cidade/UF (mapa)': lambda df: df.groupby(['cidade_destino', 'UF_Dest'])['peso_bruto'].sum(),
+        }
+        for nome, func in medidas.items():
+            t_bruto = cronometrar(lambda: func(bruto), opts['repeticoes'])
+            t_tipado = cronometrar(lambda: func(tipado), opts['repeticoes'])
+            self.stdout.write(f"{nome:<27} {t_bruto * 1000:8.2f} ms -> {t_tipado * 1000:8.2f} ms ({t_bruto / t_tipado:.1f}x)")
+
+        if opts['colunas']:
+            for col, tamanho in tipado.memory_usage(deep=True, index=False).sort_values(ascending=False).items():
+                self.stdout.write(f"  {col:<22} {str(tipado[col].dtype):<15} {tamanho / 1024:10,.1f} KB")
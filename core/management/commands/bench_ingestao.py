@@ -0,0 +1,85 @@
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from core import corpus, ingestao, parsers, services
+
+try:
+    import resource  # não existe no Windows
+except ImportError:
+    resource = None
+
+
+def pipeline(zip_buf, tipo, workers, tamanho_lote):
+    """Mesmo caminho do upload: ZIP -> parse -> LoteImportacao -> save_batch."""
+    contagem = {'total': 0}
+    lote = services.LoteImportacao(max_objetos=settings.IMPORT_MAX_OBJETOS)
+    docs = ingestao.iterar_documentos([zip_buf], contagem)
+    for res in ingestao.parsear_documentos(docs, tipo, workers=workers, tamanho_lote=tamanho_lote):
+        lote.registrar(res)
+        if lote.cheio(): lote.save_batch()
+    lote.save_batch()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark da importação com um corpus sintético de NF-e/CT-e: parse isolado e caminho completo "
+        "até o banco (num banco de teste descartável). Mostra docs/s de cada etapa e o pico de memória."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nfes', type=int, default=2000, help="Quantidade de NF-e geradas")
+        parser.add_argument('--itens', type=int, default=20, help="Média de itens por NF-e")
+        parser.add_argument('--nfs-por-cte', type=int, default=3)
+        parser.add_argument('--workers', type=int, default=0, help="Workers de parse no caminho completo")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--sem-banco', action='store_true', help="Mede só o parse")
+        parser.add_argument('--memoria', action='store_true',
+                            help="Mede o pico de memória de cada etapa com tracemalloc (deixa os tempos bem mais lentos)")
+
+    def etapa(self, nome, n_docs, func, medir_memoria):
+        if medir_memoria: tracemalloc.start()
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        pico = ''
+        if medir_memoria:
+            pico = f" | pico {tracemalloc.get_traced_memory()[1] / 1024 / 1024:,.1f} MB"
+            tracemalloc.stop()
+        self.stdout.write(f"{nome:<38} {dt:8.2f}s | {n_docs / dt:10,.1f} docs/s{pico}")
+
+    def handle(self, *args, **opts):
+        t0 = time.perf_counter()
+        nfes, ctes = corpus.gerar_documentos(opts['nfes'], opts['itens'], opts['nfs_por_cte'], seed=opts['seed'])
+        tamanho = sum(len(x) for _, x in nfes) + sum(len(x) for _, x in ctes)
+        self.stdout.write(f"Corpus: {len(nfes)} NF-e + {len(ctes)} CT-e ({tamanho / 1024 / 1024:,.1f} MB de XML) "
+                          f"gerado em {time.perf_counter() - t0:.1f}s")
+        memoria = opts['memoria']
+
+        self.etapa("parse_cte", len(ctes), lambda: [parsers.parse_cte(c, n) for n, c in ctes], memoria)
+        self.etapa("parse_nfe_header + parse_nfe_items", len(nfes),
+                   lambda: [(parsers.parse_nfe_header(c, n), parsers.parse_nfe_items(c, n)) for n, c in nfes], memoria)
+        self.etapa("parse_nfe (passada única)", len(nfes), lambda: [parsers.parse_nfe(c, n) for n, c in nfes], memoria)
+
+        if not opts['sem_banco']:
+            # Banco de teste descartável (test_<NAME> no MySQL, em memória no SQLite)
+            nome_original = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                workers, tamanho_lote = opts['workers'], settings.PARSE_LOTE
+                zip_nfe, zip_cte = corpus.zip_em_memoria(nfes), corpus.zip_em_memoria(ctes)
+                self.etapa(f"NF-e completo ({workers} workers)", len(nfes),
+                           lambda: pipeline(zip_nfe, 'nfe', workers, tamanho_lote), memoria)
+                self.etapa(f"CT-e completo ({workers} workers)", len(ctes),
+                           lambda: pipeline(zip_cte, 'cte', workers, tamanho_lote), memoria)
+                n_nfe, n_itens, n_cte = services.Nfe.objects.count(), services.Item.objects.count(), services.Cte.objects.count()
+                self.stdout.write(f"Gravados: {n_nfe} NF-e, {n_itens} itens, {n_cte} linhas de CT-e")
+            finally:
+                connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+        if resource:
+            # ru_maxrss vem em KB no Linux
+            self.stdout.write(f"Pico de RSS do processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.1f} MB")
+        if memoria and opts['workers'] > 1:
+            self.stdout.write("Obs.: o tracemalloc só enxerga o processo principal, não os workers do pool.")
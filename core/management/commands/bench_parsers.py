@@ -0,0 +1,81 @@
+import os
+import time
+import zipfile
+from django.core.management.base import BaseCommand, CommandError
+from core import corpus, parsers
+
+
+def ler_xmls(caminhos):
+    """Carrega em memória os XMLs informados (arquivos .xml, .zip ou pastas)."""
+    docs = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            for raiz, _, nomes in os.walk(caminho):
+                docs += ler_xmls([os.path.join(raiz, n) for n in sorted(nomes) if n.lower().endswith(('.xml', '.zip'))])
+        elif caminho.lower().endswith('.zip'):
+            with zipfile.ZipFile(caminho) as zf:
+                docs += [(n, zf.read(n)) for n in zf.namelist() if n.lower().endswith('.xml')]
+        elif caminho.lower().endswith('.xml'):
+            with open(caminho, 'rb') as f: docs.append((os.path.basename(caminho), f.read()))
+    return docs
+
+
+def duas_passadas(content, fname):
+    header, err = parsers.parse_nfe_header(content, fname)
+    items, _ = parsers.parse_nfe_items(content, fname)
+    return header, items, err
+
+
+def cronometrar(func, docs, repeticoes):
+    melhor = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        for fname, content in docs: func(content, fname)
+        dt = time.perf_counter() - t0
+        melhor = dt if melhor is None else min(melhor, dt)
+    return melhor
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara os parsers novos com os antigos: NF-e em passada única (parse_nfe) x header + itens, "
+        "e CT-e com XPath compiladas (parse_cte) x findtext sobre a árvore sem namespace."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('caminhos', nargs='*', help="Arquivos .xml/.zip ou pastas (sem caminhos usa um corpus sintético)")
+        parser.add_argument('--tipo', choices=['nfe', 'cte'], default='nfe')
+        parser.add_argument('--repeticoes', type=int, default=3, help="Rodadas por parser (vale a melhor)")
+        parser.add_argument('--sinteticos', type=int, default=1000, help="NF-e do corpus sintético")
+        parser.add_argument('--nfs-por-cte', type=int, default=10, help="Chaves de NF-e por CT-e no corpus sintético")
+
+    def handle(self, *args, **opts):
+        if opts['caminhos']:
+            docs = ler_xmls(opts['caminhos'])
+        else:
+            nfes, ctes = corpus.gerar_documentos(opts['sinteticos'], nfs_por_cte=opts['nfs_por_cte'])
+            docs = nfes if opts['tipo'] == 'nfe' else ctes
+        if not docs: raise CommandError("Nenhum XML encontrado nos caminhos informados.")
+
+        if opts['tipo'] == 'nfe':
+            antigo, novo = duas_passadas, parsers.parse_nfe
+            nomes = ("xmltodict (header + itens)", "lxml passada única")
+            # Garante que os dois caminhos continuam produzindo exatamente os mesmos dicts
+            divergentes = [n for n, c in docs if duas_passadas(c, n)[:2] != parsers.parse_nfe(c, n)[:2]]
+            self.stdout.write(f"Documentos: {len(docs)} | Itens: {sum(len(parsers.parse_nfe(c, n)[1]) for n, c in docs)}")
+        else:
+            antigo, novo = parsers.parse_cte_antigo, parsers.parse_cte
+            nomes = ("findtext sem namespace", "XPath compiladas")
+            divergentes = [n for n, c in docs if parsers.parse_cte_antigo(c, n) != parsers.parse_cte(c, n)]
+            self.stdout.write(f"Documentos: {len(docs)} | Linhas (NF por CT-e): {sum(len(parsers.parse_cte(c, n)[0]) for n, c in docs)}")
+
+        t_antigo = cronometrar(antigo, docs, opts['repeticoes'])
+        t_novo = cronometrar(novo, docs, opts['repeticoes'])
+
+        self.stdout.write(f"{nomes[0]:<27} {t_antigo:.3f}s ({len(docs) / t_antigo:,.0f} docs/s)")
+        self.stdout.write(f"{nomes[1]:<27} {t_novo:.3f}s ({len(docs) / t_novo:,.0f} docs/s)")
+        self.stdout.write(f"Ganho: {t_antigo / t_novo:.2f}x")
+        if divergentes:
+            self.stdout.write(self.style.ERROR(f"{len(divergentes)} documento(s) com saída diferente, ex: {divergentes[:5]}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Saídas idênticas nos dois caminhos."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from core import corpus
+
+
+class Command(BaseCommand):
+    help = "Gera ZIPs com NF-e e CT-e sintéticos (CT-es referenciando as NF-es geradas) para testes de carga."
+
+    def add_arguments(self, parser):
+        parser.add_argument('pasta', help="Pasta de saída")
+        parser.add_argument('--nfes', type=int, default=10000, help="Quantidade de NF-e")
+        parser.add_argument('--itens', type=int, default=20, help="Média de itens por NF-e")
+        parser.add_argument('--nfs-por-cte', type=int, default=3, help="Chaves de NF-e em cada CT-e")
+        parser.add_argument('--docs-por-zip', type=int, default=5000, help="XMLs em cada ZIP")
+        parser.add_argument('--seed', type=int, default=42, help="Semente (mesma semente = mesmo corpus)")
+
+    def handle(self, *args, **opts):
+        nfes, ctes = corpus.gerar_documentos(opts['nfes'], opts['itens'], opts['nfs_por_cte'], seed=opts['seed'])
+        zips = corpus.gravar_zips(nfes, opts['pasta'], 'nfe', opts['docs_por_zip'])
+        zips += corpus.gravar_zips(ctes, opts['pasta'], 'cte', opts['docs_por_zip'])
+        self.stdout.write(self.style.SUCCESS(f"{len(nfes)} NF-e e {len(ctes)} CT-e gravados em {len(zips)} ZIP(s) em {opts['pasta']}"))
+        for z in zips: self.stdout.write(f"  {z}")
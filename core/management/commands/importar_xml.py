@@ -0,0 +1,135 @@
+import os
+import time
+from collections import deque
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core import ingestao, services
+from core.models import Log
+
+
+def listar_arquivos(caminhos):
+    """Expande pastas em arquivos .xml/.zip, em ordem estável (o checkpoint depende dela)."""
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            for raiz, pastas, nomes in os.walk(caminho):
+                pastas.sort()
+                arquivos += [os.path.join(raiz, n) for n in sorted(nomes) if n.lower().endswith(('.xml', '.zip'))]
+        elif os.path.isfile(caminho):
+            arquivos.append(caminho)
+        else:
+            raise CommandError(f"Caminho não encontrado: {caminho}")
+    return [os.path.abspath(a) for a in arquivos]
+
+
+class Checkpoint:
+    """Arquivo texto com um documento concluído por linha (caminho::membro, com o caminho dos ZIPs aninhados)."""
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.feitos = set()
+        if caminho and os.path.exists(caminho):
+            with open(caminho, encoding='utf-8') as f:
+                self.feitos = {linha.rstrip('\n') for linha in f if linha.strip()}
+
+    def registrar(self, ids):
+        if not self.caminho or not ids: return
+        with open(self.caminho, 'a', encoding='utf-8') as f:
+            f.write(''.join(f"{i}\n" for i in ids))
+            f.flush()
+            os.fsync(f.fileno())
+        self.feitos.update(ids)
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa XMLs de NF-e/CT-e (arquivos, ZIPs ou pastas) direto no banco, sem passar pelo navegador. "
+        "Usa o mesmo parse e a mesma gravação em lote do upload e grava um checkpoint para retomar de onde parou."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('caminhos', nargs='+', help="Pastas, arquivos .zip ou .xml")
+        parser.add_argument('--tipo', choices=['nfe', 'cte'], required=True)
+        parser.add_argument('--workers', type=int, default=settings.PARSE_WORKERS or os.cpu_count(),
+                            help="Processos de parse em paralelo (padrão: PARSE_WORKERS ou nº de CPUs)")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Arquivo de checkpoint (padrão: .importar_xml_<tipo>.checkpoint na pasta atual)")
+        parser.add_argument('--sem-checkpoint', action='store_true', help="Não lê nem grava checkpoint")
+
+    def handle(self, *args, **opts):
+        tipo = opts['tipo']
+        arquivos = listar_arquivos(opts['caminhos'])
+        if not arquivos: raise CommandError("Nenhum .xml ou .zip encontrado.")
+
+        caminho_ckpt = None if opts['sem_checkpoint'] else (opts['checkpoint'] or f".importar_xml_{tipo}.checkpoint")
+        checkpoint = Checkpoint(caminho_ckpt)
+        if checkpoint.feitos:
+            self.stdout.write(f"Retomando: {len(checkpoint.feitos)} documentos já concluídos no checkpoint {caminho_ckpt}")
+
+        contagem = {'total': 0, 'ignorados': 0, 'checkpoint': 0}
+        chaves = services.chaves_ja_importadas(tipo)
+        # Os resultados do parse saem na mesma ordem dos documentos: esta fila casa cada um com seu id
+        ids_em_voo = deque()
+
+        def pendentes(caminho, docs):
+            for fname, content, erro in docs:
+                if f"{caminho}::{fname}" in checkpoint.feitos:
+                    contagem['checkpoint'] += 1
+                    continue
+                yield fname, content, erro
+
+        def documentos():
+            for caminho in arquivos:
+                with open(caminho, 'rb') as f:
+                    docs = ingestao.iterar_documentos([f], contagem)
+                    for fname, content, erro in ingestao.pular_ja_importados(pendentes(caminho, docs), tipo, chaves, contagem):
+                        ids_em_voo.append(f"{caminho}::{fname}")
+                        yield fname, content, erro
+
+        lote = services.LoteImportacao(max_objetos=settings.IMPORT_MAX_OBJETOS, chaves_existentes=chaves)
+        ids_no_lote = []
+        stats = {'docs': 0, 'itens': 0, 'linhas_cte': 0, 'erros': 0, 't_parse': 0.0, 't_montagem': 0.0, 't_banco': 0.0}
+
+        def gravar():
+            t0 = time.perf_counter()
+            ok = lote.save_batch()
+            stats['t_banco'] += time.perf_counter() - t0
+            if not ok:
+                raise CommandError("Falha ao gravar o lote no banco. Rode o comando de novo para retomar do checkpoint.")
+            checkpoint.registrar(ids_no_lote)
+            ids_no_lote.clear()
+
+        self.stdout.write(f"Importando {len(arquivos)} arquivo(s) de {tipo.upper()} com {opts['workers']} worker(s)...")
+        inicio = time.perf_counter()
+        resultados = ingestao.parsear_documentos(documentos(), tipo, workers=opts['workers'], tamanho_lote=settings.PARSE_LOTE)
+        for res in resultados:
+            ids_no_lote.append(ids_em_voo.popleft())
+            stats['t_parse'] += res.get('tempo_parse', 0.0)
+            if res.get('erro_arquivo') or res.get('erro') or res.get('erro_fatal'): stats['erros'] += 1
+
+            t0 = time.perf_counter()
+            if res.get('erro_arquivo'):
+                lote.logs.append(Log(arquivo=res['arquivo'], tipo_doc=tipo, status='ERRO', mensagem=res['erro_arquivo']))
+            elif not lote.registrar(res):
+                contagem['ignorados'] += 1  # repetido dentro da própria importação
+            else:
+                stats['docs'] += 1
+                stats['itens'] += len(res.get('items') or [])
+                stats['linhas_cte'] += len(res.get('rows') or [])
+            stats['t_montagem'] += time.perf_counter() - t0
+
+            if lote.cheio():
+                gravar()
+                self.stdout.write(f"  {stats['docs']} documentos gravados ({contagem['ignorados']} já existentes)...")
+        gravar()
+        # Só tem efeito se o CACHES do settings for compartilhado com o servidor web (o LocMem é por processo)
+        lote.atualizar_dashboard()
+        total = time.perf_counter() - inicio
+
+        self.stdout.write(self.style.SUCCESS("Importação concluída."))
+        self.stdout.write(f"Documentos importados: {stats['docs']} | erros: {stats['erros']} | "
+                          f"já no banco: {contagem['ignorados']} | pulados pelo checkpoint: {contagem['checkpoint']}")
+        self.stdout.write(f"Itens: {stats['itens']} | linhas de CT-e: {stats['linhas_cte']}")
+        if total > 0:
+            self.stdout.write(f"Tempo total: {total:.1f}s | {stats['docs'] / total:,.1f} docs/s | {stats['itens'] / total:,.1f} itens/s")
+        self.stdout.write(f"Parse (soma dos workers): {stats['t_parse']:.1f}s | montagem: {stats['t_montagem']:.1f}s | banco: {stats['t_banco']:.1f}s")
+        self.stdout.write("A geolocalização não roda aqui: ela continua a cargo do worker disparado pelo upload.")
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_transportadora'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(db_index=True, null=True)),
+                ('emitente_legivel', models.CharField(max_length=255, null=True)),
+                ('destinatario_legivel', models.CharField(max_length=255, null=True)),
+                ('cidade_destino', models.CharField(max_length=100, null=True)),
+                ('uf_dest', models.CharField(max_length=5, null=True)),
+                ('transportadora_final', models.CharField(max_length=255, null=True)),
+                ('frete_tipo', models.CharField(max_length=10)),
+                ('operacao', models.CharField(max_length=20)),
+                ('frete_valor', models.FloatField(default=0)),
+                ('valor_nf', models.FloatField(default=0)),
+                ('pedagio_valor', models.FloatField(default=0)),
+                ('peso_bruto', models.FloatField(default=0)),
+                ('qtd_notas', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário',
+                'verbose_name_plural': 'Resumos Diários',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_resumodiario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeoCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consulta', models.CharField(max_length=500, unique=True)),
+                ('encontrado', models.BooleanField(default=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cache de Geolocalização',
+                'verbose_name_plural': 'Cache de Geolocalização',
+            },
+        ),
+    ]
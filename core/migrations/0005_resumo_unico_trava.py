@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:35
+
+from django.db import migrations, models
+
+
+def preparar_resumo(apps, schema_editor):
+    # O cubo pode ter linhas em dobro de reconstruções simultâneas: é remontado no próximo acesso
+    apps.get_model('core', 'ResumoDiario').objects.all().delete()
+    apps.get_model('core', 'TravaResumo').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_geocache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TravaResumo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reconstruido_em', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'Trava do Resumo',
+            },
+        ),
+        migrations.RunPython(preparar_resumo, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='resumodiario',
+            name='dimensoes_hash',
+            field=models.CharField(default='', editable=False, max_length=40, unique=True),
+            preserve_default=False,
+        ),
+    ]
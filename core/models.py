@@ -155,4 +155,63 @@ class Transportadora(models.Model):
 
     class Meta:
         verbose_name = "Transportadora"
-        verbose_name_plural = "Transportadoras"
\ No newline at end of file
+        verbose_name_plural = "Transportadoras"
+
+class ResumoDiario(models.Model):
+    """
+    Cubo diário do dashboard: notas somadas por dia e pelas dimensões dos filtros.
+    Mantido pelo services: atualizar_resumo a cada importação e exclusão/edição
+    de NF-e ou CT-e (signals.py), reconstruído junto com cada montagem completa
+    do snapshot do dashboard; não editar à mão.
+    """
+    data = models.DateField(null=True, db_index=True)
+    emitente_legivel = models.CharField(max_length=255, null=True)
+    destinatario_legivel = models.CharField(max_length=255, null=True)
+    cidade_destino = models.CharField(max_length=100, null=True)
+    uf_dest = models.CharField(max_length=5, null=True)
+    transportadora_final = models.CharField(max_length=255, null=True)
+    frete_tipo = models.CharField(max_length=10)
+    operacao = models.CharField(max_length=20)
+    # SHA-1 das oito dimensões acima (services._linhas_resumo): uma linha por combinação, e uma
+    # reconstrução em dobro falha em vez de somar os KPIs duas vezes. Índice único simples,
+    # que cabe no limite do InnoDB (as dimensões juntas não caberiam)
+    dimensoes_hash = models.CharField(max_length=40, unique=True, editable=False)
+
+    frete_valor = models.FloatField(default=0)
+    valor_nf = models.FloatField(default=0)
+    pedagio_valor = models.FloatField(default=0)
+    peso_bruto = models.FloatField(default=0)
+    qtd_notas = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Resumo Diário"
+        verbose_name_plural = "Resumos Diários"
+
+class TravaResumo(models.Model):
+    """
+    Linha única (pk=1) travada com select_for_update por quem reescreve o
+    ResumoDiario: reconstruções e atualizações do cubo rodam uma de cada vez.
+    """
+    reconstruido_em = models.DateTimeField(null=True)
+
+    class Meta:
+        verbose_name = "Trava do Resumo"
+
+class GeoCache(models.Model):
+    """
+    Cache persistente do Nominatim: uma linha por consulta normalizada (CEP ou
+    endereço limpo). encontrado=False guarda a busca sem resultado, para não
+    repetir a consulta (e o sleep) até vencer. Apagar a linha força nova busca.
+    """
+    consulta = models.CharField(max_length=500, unique=True)
+    encontrado = models.BooleanField(default=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.consulta
+
+    class Meta:
+        verbose_name = "Cache de Geolocalização"
+        verbose_name_plural = "Cache de Geolocalização"
@@ -1,3 +1,5 @@
+import os
+import re
 import xmltodict
 from lxml import etree
 from datetime import datetime
@@ -5,17 +7,146 @@ from .utils import xml_float, br_weight, limpar_cnpj
 
 PARSER = etree.XMLParser(recover=True, encoding='utf-8')
 
+# ==============================================================================
+# CHAVE DE ACESSO SEM PARSE (PARA PULAR DOCUMENTOS JÁ IMPORTADOS)
+# ==============================================================================
+RE_ID_CHAVE = re.compile(rb'Id\s*=\s*["\'](NFe|CTe)(\d{44})["\']')
+RE_CHAVE_NOME = re.compile(r'(?<!\d)(\d{44})(?!\d)')
+# Modelo do documento fica nas posições 21-22 da chave
+MODELOS = {'nfe': ('55', '65'), 'cte': ('57', '67')}
+PREFIXOS = {'nfe': b'NFe', 'cte': b'CTe'}
+
+def chave_rapida(content, fname, tipo):
+    """
+    Chave de acesso do documento sem montar a árvore: primeiro procura o
+    atributo Id="NFe..."/Id="CTe..." nos bytes, depois tenta o nome do arquivo.
+    Devolve '' se não achar (o documento segue para o parse normal).
+    """
+    if isinstance(content, str): content = content.encode('utf-8')
+    m = RE_ID_CHAVE.search(content) if content else None
+    if m: return m.group(2).decode() if m.group(1) == PREFIXOS.get(tipo) else ''
+    m = RE_CHAVE_NOME.search(os.path.basename(fname or ''))
+    if m and m.group(1)[20:22] in MODELOS.get(tipo, ()): return m.group(1)
+    return ''
+
 # ==============================================================================
 # PARSER DE CTE
 # ==============================================================================
 def strip_namespace(root):
-    for elem in root.getiterator():
+    for elem in root.iter():
         if not hasattr(elem.tag, 'find'): continue
         i = elem.tag.find('}')
         if i >= 0: elem.tag = elem.tag[i+1:]
     return root
 
+# Caminhos relativos ao <infCte>, compilados uma vez por namespace ({p} vira o prefixo)
+CAMINHOS_CTE = {
+    'dhEmi': '{p}ide/{p}dhEmi', 'tpCTe': '{p}ide/{p}tpCTe', 'nCT': '{p}ide/{p}nCT',
+    'xMunIni': '{p}ide/{p}xMunIni', 'UFIni': '{p}ide/{p}UFIni', 'xMunFim': '{p}ide/{p}xMunFim', 'UFFim': '{p}ide/{p}UFFim',
+    'dest_xMun': '{p}dest/{p}enderDest/{p}xMun', 'dest_UF': '{p}dest/{p}enderDest/{p}UF',
+    'emit_xNome': '{p}emit/{p}xNome', 'emit_CNPJ': '{p}emit/{p}CNPJ', 'rem_xNome': '{p}rem/{p}xNome', 'dest_xNome': '{p}dest/{p}xNome',
+    'enderEmit': '{p}emit/{p}enderEmit', 'xLgr': '{p}xLgr', 'nro': '{p}nro', 'CEP': '{p}CEP',
+    'vTPrest': './/{p}vTPrest', 'qCarga': './/{p}qCarga', 'chCTe_ref': './/{p}infCteComp/{p}chCTe',
+    'Comp': './/{p}Comp', 'Comp_xNome': '{p}xNome', 'Comp_vComp': '{p}vComp',
+    'chaves_nf': './/{p}infNFe/{p}chave[1]',
+}
+_XPATHS_CTE = {}
+
+def _xpaths_cte(ns):
+    xp = _XPATHS_CTE.get(ns)
+    if xp is None:
+        prefixo, nsmap = ('c:', {'c': ns}) if ns else ('', None)
+        xp = _XPATHS_CTE[ns] = {k: etree.XPath(v.format(p=prefixo), namespaces=nsmap) for k, v in CAMINHOS_CTE.items()}
+    return xp
+
+def _primeiro(nos, default=None):
+    # Mesmo retorno do findtext: default se a tag não existe, '' se existe vazia
+    return (nos[0].text or '') if nos else default
+
 def parse_cte(raw, fname):
+    try:
+        if isinstance(raw, str): raw = raw.encode('utf-8')
+        rt = etree.fromstring(raw, PARSER)
+        if rt is None: return [], "XML Inválido"
+        inf = next(rt.iterdescendants('{*}infCte'), None)
+        
+        if inf is None:
+            if next(rt.iterdescendants('{*}retEventoCTe'), None) is not None: return [], "Evento de CT-e"
+            return [], "XML Inválido"
+        xp = _xpaths_cte(etree.QName(inf).namespace)
+        
+        cte_id = inf.get("Id", "")
+        chave_cte_propria = cte_id.replace("CTe", "").strip() if cte_id else ""
+        
+        dh = _primeiro(xp['dhEmi'](inf)) or ""; data = dh[:10] 
+        try: data = datetime.strptime(data, "%Y-%m-%d").strftime("%d/%m/%Y")
+        except: pass
+        
+        tp_cte = _primeiro(xp['tpCTe'](inf))
+        vp = xp['vTPrest'](inf); frete = xml_float(vp[0].text) if vp else 0.0
+        peso = sum(xml_float(n.text) for n in xp['qCarga'](inf))
+        
+        pedagio = 0.0
+        for c in xp['Comp'](inf):
+            nm = _primeiro(xp['Comp_xNome'](c), "").upper()
+            if "PEDAGIO" in nm or "VALE" in nm: pedagio += xml_float(_primeiro(xp['Comp_vComp'](c), "0"))
+                
+        m_ini = _primeiro(xp['xMunIni'](inf)); u_ini = _primeiro(xp['UFIni'](inf))
+        m_fim = _primeiro(xp['xMunFim'](inf)) or _primeiro(xp['dest_xMun'](inf))
+        u_fim = _primeiro(xp['UFFim'](inf)) or _primeiro(xp['dest_UF'](inf))
+        chave_ref = _primeiro(xp['chCTe_ref'](inf), "")
+        
+        chaves = [n.text for n in xp['chaves_nf'](inf) if n.text]
+        if not chaves: chaves = [""]
+
+        # CAPTURA ENDEREÇO DO EMITENTE (TRANSPORTADORA)
+        ender_emit = xp['enderEmit'](inf)
+        ender_emit = ender_emit[0] if ender_emit else None
+        
+        x_lgr = _primeiro(xp['xLgr'](ender_emit)) if ender_emit is not None else ""
+        nro = _primeiro(xp['nro'](ender_emit)) if ender_emit is not None else ""
+        end_completo = f"{x_lgr}, {nro}".strip(", ")
+
+        # Campos iguais em todas as linhas do documento
+        comum = {
+            "chave_cte_propria": chave_cte_propria,
+            "data": data, 
+            "numero_cte": _primeiro(xp['nCT'](inf)),
+            "emitente": _primeiro(xp['emit_xNome'](inf)), 
+            "cnpj_emit": _primeiro(xp['emit_CNPJ'](inf)),
+            "remetente": _primeiro(xp['rem_xNome'](inf)), 
+            "destinatario": _primeiro(xp['dest_xNome'](inf)),
+            "frete_valor": frete, 
+            "peso_kg": peso, 
+            "cidade_origem": f"{m_ini}-{u_ini}" if m_ini else "ND",
+            "cidade_destino": f"{m_fim}-{u_fim}" if m_fim else "ND",
+            "pedagio_valor": pedagio, 
+            "chave_ref_cte": chave_ref,
+            "tp_cte": tp_cte,
+            "arquivo": fname,
+            
+            # Dados Extras para Transportadora
+            "emit_endereco": end_completo,
+            "emit_cidade": m_ini,
+            "emit_uf": u_ini,
+            "emit_cep": _primeiro(xp['CEP'](ender_emit)) if ender_emit is not None else ""
+        }
+
+        lines = []
+        for k in chaves:
+            k = str(k).strip()
+            n_nf = str(int(k[25:34])) if k and len(k)==44 and k.isdigit() else ""
+            lines.append({**comum, "chave_nf": k, "numero_nf_cte": n_nf})
+        return lines, None
+    except Exception as e: return [], str(e)
+
+# ==============================================================================
+# PARSER DE CTE - REFERÊNCIA (ANTES DAS XPATH COMPILADAS)
+# ==============================================================================
+# Mantido como está para o bench_parsers comparar saídas e tempos com o parse_cte,
+# como parse_nfe_header/parse_nfe_items para o parse_nfe. Não usar na importação.
+def parse_cte_antigo(raw, fname):
+    """parse_cte de antes das XPath compiladas (tira o namespace de tudo e faz findtext por linha)."""
     try:
         if isinstance(raw, str): raw = raw.encode('utf-8')
         rt = etree.fromstring(raw, PARSER); rt = strip_namespace(rt)
@@ -224,4 +355,141 @@ def parse_nfe_items(content, filename):
             })
         return items, None
     except Exception as e:
-        return [], f"Erro Items: {str(e)}"
\ No newline at end of file
+        return [], f"Erro Items: {str(e)}"
+
+# ==============================================================================
+# PARSER DE NFE - PASSADA ÚNICA (HEADER + ITENS NO MESMO PARSE)
+# ==============================================================================
+# Mesmo resultado de parse_nfe_header + parse_nfe_items, mas o XML é lido uma
+# única vez pelo lxml. As regras do xmltodict são imitadas: tag ausente devolve
+# o default e tag vazia devolve None.
+PARSER_NFE = etree.XMLParser(remove_comments=True, resolve_entities=False)
+
+def _local(tag):
+    return tag[tag.find('}')+1:] if isinstance(tag, str) else ''
+
+def _ns(el):
+    return el.tag[:el.tag.find('}')+1] if el.tag.startswith('{') else ''
+
+def _filho(el, ns, tag):
+    return el.find(ns + tag) if el is not None else None
+
+def _txt(el, ns, tag, default=None):
+    if el is None: return default
+    no = el.find(ns + tag)
+    if no is None: return default
+    return (no.text or '').strip() or None
+
+def _vazio(el):
+    return len(el) == 0 and not el.attrib and not (el.text or '').strip()
+
+def parse_nfe(content, filename):
+    try:
+        if isinstance(content, str): content = content.encode('utf-8')
+        rt = etree.fromstring(content, PARSER_NFE)
+
+        nfe_node = None
+        if _local(rt.tag) == 'nfeProc':
+            nfe_node = next((c for c in rt if _local(c.tag) == 'NFe'), None)
+        elif _local(rt.tag) == 'NFe':
+            nfe_node = rt
+        inf_nfe = next((c for c in nfe_node if _local(c.tag) == 'infNFe'), None) if nfe_node is not None else None
+    except Exception as e: return None, [], f"Erro Header: {str(e)}"
+
+    ns = _ns(inf_nfe) if inf_nfe is not None else ''
+    ide = _filho(inf_nfe, ns, 'ide')
+    emit = _filho(inf_nfe, ns, 'emit')
+    dets = inf_nfe.findall(ns + 'det') if inf_nfe is not None else []
+
+    chave_raw = inf_nfe.get('Id', '') if inf_nfe is not None else ''
+    chave_final = chave_raw.replace('NFe', '').strip() if chave_raw else ''
+    numero_nf = _txt(ide, ns, 'nNF', '')
+    emitente = _txt(emit, ns, 'xNome', '')
+
+    try:
+        dest = _filho(inf_nfe, ns, 'dest')
+        total = _filho(_filho(inf_nfe, ns, 'total'), ns, 'ICMSTot')
+        transp = _filho(inf_nfe, ns, 'transp')
+        transporta = _filho(transp, ns, 'transporta')
+
+        ender_dest = _filho(dest, ns, 'enderDest')
+        endereco_dest_completo = f"{_txt(ender_dest, ns, 'xLgr', '')}, {_txt(ender_dest, ns, 'nro', '')}"
+
+        ender_emit = _filho(emit, ns, 'enderEmit')
+        endereco_emit_completo = f"{_txt(ender_emit, ns, 'xLgr', '')}, {_txt(ender_emit, ns, 'nro', '')}"
+
+        dt_emissao = _txt(ide, ns, 'dhEmi', '')
+        if not dt_emissao: dt_emissao = _txt(ide, ns, 'dEmi', '')
+        if dt_emissao: dt_emissao = dt_emissao[:10]
+        try: dt_obj = datetime.strptime(dt_emissao, "%Y-%m-%d").strftime("%d/%m/%Y")
+        except: dt_obj = None
+
+        # <det/> único e vazio vira None no xmltodict (zero itens)
+        qtd_itens = 0 if len(dets) == 1 and _vazio(dets[0]) else len(dets)
+
+        peso_b = 0.0
+        if transp is not None:
+            for v in transp.findall(ns + 'vol'):
+                if len(v): peso_b += float(_txt(v, ns, 'pesoB') or 0)
+
+        header = {
+            'chave_nf': chave_final,
+            'data': dt_obj,
+            'numero_nf': numero_nf,
+            'emitente': emitente,
+            'cnpj_emit': limpar_cnpj(_txt(emit, ns, 'CNPJ', '')),
+            'destinatario': _txt(dest, ns, 'xNome', ''),
+            'cnpj_dest': limpar_cnpj(_txt(dest, ns, 'CNPJ', '') or _txt(dest, ns, 'CPF', '')),
+
+            'uf_dest': _txt(ender_dest, ns, 'UF', ''),
+            'cidade_destino': _txt(ender_dest, ns, 'xMun', ''),
+            'endereco_dest': endereco_dest_completo,
+            'bairro_dest': _txt(ender_dest, ns, 'xBairro', ''),
+            'cep_dest': _txt(ender_dest, ns, 'CEP', ''),
+
+            'uf_emit': _txt(ender_emit, ns, 'UF', ''),
+            'cidade_origem': _txt(ender_emit, ns, 'xMun', ''),
+            'endereco_emit': endereco_emit_completo,
+            'bairro_emit': _txt(ender_emit, ns, 'xBairro', ''),
+            'cep_emit': _txt(ender_emit, ns, 'CEP', ''),
+
+            'valor_nf': float(_txt(total, ns, 'vNF') or 0),
+            'peso_bruto': peso_b,
+            'mod_frete': _txt(transp, ns, 'modFrete', '9'),
+            'cfop_predominante': '',
+            'tipo_operacao': _txt(ide, ns, 'tpNF', '1'),
+            'qtd_itens': qtd_itens,
+
+            'transportadora': _txt(transporta, ns, 'xNome', 'Próprio/Outros'),
+            'transportadora_cnpj': limpar_cnpj(_txt(transporta, ns, 'CNPJ', '')),
+            'transportadora_endereco': _txt(transporta, ns, 'xEnder', ''),
+            'transportadora_cidade': _txt(transporta, ns, 'xMun', ''),
+            'transportadora_uf': _txt(transporta, ns, 'UF', '')
+        }
+    except Exception as e: return None, [], f"Erro Header: {str(e)}"
+
+    # Itens com falha não derrubam o header (mesmo contrato de parse_nfe_items)
+    items = []
+    try:
+        for i, d in enumerate(dets):
+            if _vazio(d): continue
+            prod = _filho(d, ns, 'prod')
+            q_com = _txt(prod, ns, 'qCom')
+
+            items.append({
+                'chave_nf': chave_final,
+                'numero_nf': numero_nf,
+                'emitente': emitente,
+                'item_num': d.get('nItem') or str(i + 1),
+                'produto': _txt(prod, ns, 'xProd') or _txt(prod, ns, 'cProd', 'PRODUTO SEM NOME'),
+                'ncm': _txt(prod, ns, 'NCM', ''),
+                'cfop': _txt(prod, ns, 'CFOP', ''),
+                'unidade': _txt(prod, ns, 'uCom', ''),
+                'qtd_display': br_weight(q_com),
+                'qtd_float': float(q_com or 0),
+                'vl_total': float(_txt(prod, ns, 'vProd') or 0),
+                'arquivo': filename
+            })
+    except Exception:
+        items = []
+    return header, items, None
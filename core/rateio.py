@@ -0,0 +1,29 @@
+# rateio.py
+# Rateio do frete de cada CT-e entre as notas que ele transporta, vetorizado
+# (antes era um apply linha a linha dentro do get_dashboard_data).
+import numpy as np
+
+REGRAS_RATEIO = {
+    'peso': 'peso_nf_ref',    # proporcional ao peso bruto da NF
+    'valor': 'valor_nf_ref',  # proporcional ao valor da NF
+}
+
+def ratear_frete(df, regra='peso', col_grupo='chave_cte_propria', col_frete='frete_valor'):
+    """
+    Parcela do frete de cada linha CT-e x NF.
+    Mesma regra do antigo calcular_parcela: frete zero dá zero; com base
+    (peso ou valor) total > 0 o rateio é proporcional; sem base, divide
+    igualmente entre as notas do CT-e.
+    """
+    if regra not in REGRAS_RATEIO: raise ValueError(f"Regra de rateio desconhecida: {regra}")
+    col_base = REGRAS_RATEIO[regra]
+    grupos = df.groupby(col_grupo, sort=False)
+    total_base = grupos[col_base].transform('sum').to_numpy(dtype=float)
+    qtd_notas = grupos['chave_nf'].transform('count').to_numpy(dtype=float)
+
+    frete = df[col_frete].to_numpy(dtype=float)
+    base = df[col_base].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proporcional = frete * (base / total_base)
+        igualitario = np.where(qtd_notas > 0, frete / qtd_notas, frete)
+    return np.where(frete == 0, 0.0, np.where(total_base > 0, proporcional, igualitario))
@@ -1,9 +1,19 @@
+import hashlib
+import numpy as np
 import pandas as pd
-from django.core.cache import cache
-from .models import Nfe, Cte, Item, MemoriaIa, Cliente, ProdutoMap, Transportadora
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Nfe, Cte, Item, Log, MemoriaIa, Cliente, ProdutoMap, Transportadora, ResumoDiario, TravaResumo
 from .config import CNPJS_CIA, TABELA_ANTT
+from .rateio import ratear_frete
+from . import snapshot
 from .utils import limpar_cnpj, get_regiao, COORDS_UF
-from .utils import extrair_peso_do_nome
+from .utils import extrair_peso_do_nome, br_weight
 
 # ... (MANTENHA get_items_por_nf e obter_peso_produto COMO ESTAVAM) ...
 
@@ -23,33 +33,68 @@ def obter_peso_produto(nome_produto_xml):
     )
     return peso_calculado
 
+# ==============================================================================
+# RESOLVEDOR DE PESO EM MEMÓRIA (UM POR UPLOAD)
+# ==============================================================================
+# Mesmo nome de produto aparece milhares de vezes; a regex roda uma vez só
+_peso_pelo_nome = lru_cache(maxsize=50000)(extrair_peso_do_nome)
+
+class ResolvedorPeso:
+    """
+    Versão em lote de obter_peso_produto: carrega o ProdutoMap inteiro uma vez
+    e guarda os produtos novos para um único bulk_create no save_batch.
+    O loop de itens não faz nenhuma query.
+    """
+    def __init__(self):
+        self.pesos = dict(ProdutoMap.objects.values_list('nome_produto', 'peso_unitario_kg'))
+        self.novos = {}
+
+    def peso(self, nome_produto_xml):
+        nome_limpo = str(nome_produto_xml).strip()[:255]
+        peso = self.pesos.get(nome_limpo)
+        if peso is not None: return peso
+        peso = _peso_pelo_nome(nome_limpo)
+        self.pesos[nome_limpo] = peso
+        self.novos[nome_limpo] = ProdutoMap(nome_produto=nome_limpo, peso_unitario_kg=peso, manual=False)
+        return peso
+
+    def salvar(self):
+        if not self.novos: return
+        # ignore_conflicts: outro upload pode ter criado o mesmo produto nesse meio tempo
+        ProdutoMap.objects.bulk_create(list(self.novos.values()), ignore_conflicts=True, batch_size=500)
+        self.novos.clear()
+
 # --- NOVA FUNÇÃO QUE USA OS DADOS JÁ LIDOS ---
+def _dados_transportadora(dados, tipo_doc):
+    """(cnpj, campos) da transportadora a partir de um header de NF-e ou linha de CT-e."""
+    # Estratégia: Pegar dados do dicionário gerado pelo Parser
+    if tipo_doc == 'nfe':
+        cnpj = dados.get('transportadora_cnpj')
+        campos = {
+            'nome': dados.get('transportadora'),
+            'cidade': dados.get('transportadora_cidade'),
+            'uf': dados.get('transportadora_uf'),
+            'endereco': dados.get('transportadora_endereco'),
+            'cep': None  # NFe raramente tem CEP da transportadora no grupo <transporta>
+        }
+    elif tipo_doc == 'cte':
+        # No CTe, o EMITENTE é a Transportadora
+        cnpj = dados.get('cnpj_emit')
+        campos = {
+            'nome': dados.get('emitente'),
+            'endereco': dados.get('emit_endereco'),  # Parser atualizado pegou isso
+            'cidade': dados.get('emit_cidade'),
+            'uf': dados.get('emit_uf'),
+            'cep': dados.get('emit_cep')
+        }
+    else:
+        return None, {}
+    return cnpj, campos
+
 def cadastrar_transportadora_xml(dados, tipo_doc):
     try:
-        cnpj = None
-        nome = None
-        endereco = None
-        cidade = None
-        uf = None
-        cep = None
-
-        # Estratégia: Pegar dados do dicionário gerado pelo Parser
-        if tipo_doc == 'nfe':
-            cnpj = dados.get('transportadora_cnpj')
-            nome = dados.get('transportadora')
-            cidade = dados.get('transportadora_cidade')
-            uf = dados.get('transportadora_uf')
-            endereco = dados.get('transportadora_endereco')
-            # NFe raramente tem CEP da transportadora no grupo <transporta>
-
-        elif tipo_doc == 'cte':
-            # No CTe, o EMITENTE é a Transportadora
-            cnpj = dados.get('cnpj_emit')
-            nome = dados.get('emitente')
-            endereco = dados.get('emit_endereco') # Parser atualizado pegou isso
-            cidade = dados.get('emit_cidade')
-            uf = dados.get('emit_uf')
-            cep = dados.get('emit_cep')
+        cnpj, campos = _dados_transportadora(dados, tipo_doc)
+        nome, endereco, cidade, uf, cep = (campos.get(k) for k in ('nome', 'endereco', 'cidade', 'uf', 'cep'))
 
         # Só cadastra se tiver CNPJ válido
         if cnpj and len(cnpj) > 10:
@@ -81,23 +126,28 @@ def cadastrar_transportadora_xml(dados, tipo_doc):
         print(f"Erro ao salvar transportadora ({tipo_doc}): {e}")
 
 # ... (MANTENHA AS OUTRAS FUNÇÕES: cadastrar_ou_atualizar_cliente e get_dashboard_data) ...
+def _dados_cliente(dados_header):
+    """Campos do Cliente a partir do header da NF-e (já truncados)."""
+    nome = (dados_header.get('destinatario') or '')[:255]
+    return {
+        'nome': nome, 'razao_social': nome,
+        'cidade': (dados_header.get('cidade_destino') or '')[:100],
+        'uf': (dados_header.get('uf_dest') or '')[:2],
+        'endereco': (dados_header.get('endereco_dest') or dados_header.get('endereco') or '')[:255],
+        'bairro': (dados_header.get('bairro_dest') or dados_header.get('bairro') or '')[:100],
+        'cep': (dados_header.get('cep_dest') or dados_header.get('cep') or '')[:10],
+    }
+
 def cadastrar_ou_atualizar_cliente(dados_header, buscar_geo=True):
     from .utils import get_lat_lon, get_distancia_osrm, ORIGEM_PADRAO
     if not dados_header: return
     cnpj = dados_header.get('cnpj_dest')
     if not cnpj: return
 
-    nome = (dados_header.get('destinatario') or '')[:255]
-    cidade = (dados_header.get('cidade_destino') or '')[:100]
-    uf = (dados_header.get('uf_dest') or '')[:2]
-    endereco = (dados_header.get('endereco_dest') or dados_header.get('endereco') or '')[:255]
-    bairro = (dados_header.get('bairro_dest') or dados_header.get('bairro') or '')[:100]
-    cep = (dados_header.get('cep_dest') or dados_header.get('cep') or '')[:10]
-
-    cliente, created = Cliente.objects.get_or_create(
-        cpf_cnpj=cnpj,
-        defaults={'nome': nome, 'razao_social': nome, 'cidade': cidade, 'uf': uf, 'endereco': endereco, 'bairro': bairro, 'cep': cep}
-    )
+    defaults = _dados_cliente(dados_header)
+    endereco, bairro, cep = defaults['endereco'], defaults['bairro'], defaults['cep']
+
+    cliente, created = Cliente.objects.get_or_create(cpf_cnpj=cnpj, defaults=defaults)
     if not created:
         mudou = False
         if not cliente.bairro and bairro: cliente.bairro = bairro; mudou = True
@@ -113,13 +163,445 @@ def cadastrar_ou_atualizar_cliente(dados_header, buscar_geo=True):
         cliente.distancia_km = get_distancia_osrm(ORIGEM_PADRAO['lat'], ORIGEM_PADRAO['lon'], lat, lon)
         cliente.save()
 
-def get_dashboard_data():
-    cached_df = cache.get('dashboard_df')
-    if cached_df is not None: return cached_df
+# ==============================================================================
+# CADASTRO DE CLIENTES EM LOTE (USADO NA IMPORTAÇÃO)
+# ==============================================================================
+class RegistroClientes:
+    """
+    Mesma regra de cadastrar_ou_atualizar_cliente(buscar_geo=False), mas por lote:
+    destinatários repetidos são unidos em memória e o banco recebe um in_bulk,
+    um bulk_create e um bulk_update por save_batch, não importa quantas notas.
+    """
+    # Cliente existente só ganha o que estiver vazio (enriquecimento)
+    CAMPOS_ENRIQUECIMENTO = ('bairro', 'cep', 'endereco')
+
+    def __init__(self):
+        self.pendentes = {}
+
+    def adicionar(self, dados_header):
+        if not dados_header: return
+        cnpj = dados_header.get('cnpj_dest')
+        if not cnpj: return
+        campos = _dados_cliente(dados_header)
+        atual = self.pendentes.get(cnpj)
+        if atual is None:
+            self.pendentes[cnpj] = campos
+            return
+        for c in self.CAMPOS_ENRIQUECIMENTO:
+            if not atual[c] and campos[c]: atual[c] = campos[c]
+
+    def salvar(self):
+        if not self.pendentes: return
+        existentes = Cliente.objects.in_bulk(list(self.pendentes))
+        novos, alterados = [], []
+        agora = timezone.now()
+        for cnpj, campos in self.pendentes.items():
+            cliente = existentes.get(cnpj)
+            if cliente is None:
+                novos.append(Cliente(cpf_cnpj=cnpj, **campos))
+                continue
+            mudou = False
+            for c in self.CAMPOS_ENRIQUECIMENTO:
+                if not getattr(cliente, c) and campos[c]: setattr(cliente, c, campos[c]); mudou = True
+            if mudou:
+                # bulk_update não dispara o auto_now
+                cliente.data_atualizacao = agora
+                alterados.append(cliente)
+
+        if novos: Cliente.objects.bulk_create(novos, ignore_conflicts=True, batch_size=500)
+        if alterados: Cliente.objects.bulk_update(alterados, list(self.CAMPOS_ENRIQUECIMENTO) + ['data_atualizacao'], batch_size=500)
+        self.pendentes.clear()
+
+# ==============================================================================
+# CADASTRO DE TRANSPORTADORAS EM LOTE (USADO NA IMPORTAÇÃO)
+# ==============================================================================
+class RegistroTransportadoras:
+    """
+    Mesma regra de cadastrar_transportadora_xml, deduplicada por CNPJ no upload
+    inteiro. O estado conhecido de cada transportadora fica em memória; só as
+    que ganharam dado novo desde o último save_batch voltam para o banco.
+    """
+    CAMPOS_ENRIQUECIMENTO = ('cidade', 'uf', 'endereco', 'cep')
+    TAMANHOS = {'nome': 255, 'endereco': 255, 'cidade': 100, 'uf': 2, 'cep': 10}
+
+    def __init__(self):
+        self.conhecidas = {}
+        self.alteradas = set()
+
+    def adicionar(self, dados, tipo_doc):
+        cnpj, campos = _dados_transportadora(dados, tipo_doc)
+        if not cnpj or len(cnpj) <= 10: return
+        campos = {k: (v[:self.TAMANHOS[k]] if v else None) for k, v in campos.items()}
+
+        atual = self.conhecidas.get(cnpj)
+        if atual is None:
+            campos['nome'] = campos['nome'] or 'Transportadora'
+            self.conhecidas[cnpj] = campos
+            self.alteradas.add(cnpj)
+            return
+        for c in self.CAMPOS_ENRIQUECIMENTO:
+            if not atual[c] and campos[c]:
+                atual[c] = campos[c]
+                self.alteradas.add(cnpj)
+
+    def salvar(self):
+        if not self.alteradas: return
+        existentes = Transportadora.objects.in_bulk(list(self.alteradas))
+        novas, alteradas = [], []
+        agora = timezone.now()
+        for cnpj in self.alteradas:
+            campos = self.conhecidas[cnpj]
+            obj = existentes.get(cnpj)
+            if obj is None:
+                novas.append(Transportadora(cnpj=cnpj, **{k: v for k, v in campos.items() if v}))
+                continue
+            mudou = False
+            for c in self.CAMPOS_ENRIQUECIMENTO:
+                if not getattr(obj, c) and campos[c]: setattr(obj, c, campos[c]); mudou = True
+                # O que já está no banco passa a ser o estado conhecido (não reenvia depois)
+                campos[c] = getattr(obj, c)
+            if mudou:
+                obj.data_atualizacao = agora
+                alteradas.append(obj)
+
+        if novas: Transportadora.objects.bulk_create(novas, ignore_conflicts=True, batch_size=500)
+        if alteradas: Transportadora.objects.bulk_update(alteradas, list(self.CAMPOS_ENRIQUECIMENTO) + ['data_atualizacao'], batch_size=500)
+        self.alteradas.clear()
+
+# ==============================================================================
+# IMPORTAÇÃO EM LOTE (BUFFERS DO UPLOAD + save_batch)
+# ==============================================================================
+def chaves_ja_importadas(tipo):
+    """Conjunto das chaves de acesso já gravadas (carregado uma vez por upload)."""
+    if tipo == 'nfe': qs = Nfe.objects.values_list('chave_nf', flat=True)
+    elif tipo == 'cte': qs = Cte.objects.values_list('chave_cte_propria', flat=True).distinct()
+    else: return set()
+    return set(qs.iterator(chunk_size=10000))
+
+
+def _parse_date(dt_str):
+    try: return datetime.strptime(dt_str, "%d/%m/%Y").date()
+    except: return None
+
+class LoteImportacao:
+    """
+    Acumula os objetos de um upload e grava tudo em bulk no save_batch.
+    Recebe os resultados de ingestao.parse_documento (nada de XML aqui).
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, max_objetos=20000, chaves_existentes=None):
+        self.max_objetos = max_objetos
+        # Chaves já gravadas (o mesmo conjunto do ingestao.pular_ja_importados) e as
+        # do lote atual, que só passam para o conjunto depois do save_batch dar certo
+        self.chaves_existentes = chaves_existentes if chaves_existentes is not None else set()
+        self.chaves_lote = set()
+        self.objs_cte = []; self.objs_nfe = []; self.objs_item = []; self.logs = []
+        self.pesos = ResolvedorPeso()
+        self.clientes = RegistroClientes()
+        self.transportadoras = RegistroTransportadoras()
+        # Notas tocadas neste upload, para atualizar só elas no snapshot do dashboard
+        self.chaves_nf = set()
+
+    def cheio(self):
+        # Orçamento de memória: itens também contam, não só NF-e/CT-e
+        em_memoria = len(self.objs_nfe) + len(self.objs_cte) + len(self.objs_item) + len(self.logs)
+        return len(self.objs_nfe) >= self.BATCH_SIZE or len(self.objs_cte) >= self.BATCH_SIZE or em_memoria >= self.max_objetos
+
+    def save_batch(self):
+        try:
+            self.pesos.salvar()
+            self.clientes.salvar()
+            self.transportadoras.salvar()
+            if self.objs_cte: Cte.objects.bulk_create(self.objs_cte, ignore_conflicts=True); self.objs_cte.clear()
+            if self.objs_nfe: Nfe.objects.bulk_create(self.objs_nfe, ignore_conflicts=True); self.objs_nfe.clear()
+            if self.objs_item: Item.objects.bulk_create(self.objs_item, ignore_conflicts=True, batch_size=500); self.objs_item.clear()
+            if self.logs: Log.objects.bulk_create(self.logs, ignore_conflicts=True); self.logs.clear()
+            self.chaves_existentes |= self.chaves_lote
+            return True
+        except Exception as db_err:
+            print(f"Erro no Batch DB: {db_err}")
+            close_old_connections()
+            return False
+        finally:
+            # Lote que falhou não conta como importado: outra cópia da chave ainda pode entrar
+            self.chaves_lote.clear()
+
+    def atualizar_dashboard(self):
+        # Cubo diário e snapshot do dashboard: só o que este upload tocou. O cubo vem
+        # antes porque a versão nova do snapshot é o que invalida os gráficos em cache
+        atualizar_resumo(self.chaves_nf)
+        atualizar_dashboard(self.chaves_nf)
+        self.chaves_nf = set()
+
+    def _chave(self, res):
+        if res.get('erro_fatal') or res.get('erro'): return ''
+        if res['tipo'] == 'cte': return res['rows'][0]['chave_cte_propria'] if res.get('rows') else ''
+        if res['tipo'] == 'nfe': return res['header']['chave_nf'] if res.get('header') else ''
+        return ''
+
+    def registrar(self, res):
+        """Monta os objetos do documento. False = chave já gravada ou já neste lote (repetido no upload)."""
+        fname = res['arquivo']; tipo = res['tipo']
+        chave = self._chave(res)
+        if chave and (chave in self.chaves_existentes or chave in self.chaves_lote): return False
+        try:
+            if res.get('erro_fatal'):
+                self.logs.append(Log(arquivo=fname, tipo_doc=tipo, status='ERRO FATAL', mensagem=res['erro_fatal']))
+
+            elif tipo == 'cte':
+                rows, err = res['rows'], res['erro']
+                if err: self.logs.append(Log(arquivo=fname, tipo_doc='CT-e', status='ERRO', mensagem=err))
+                else:
+                    # 1. Cadastra Transportadora (Emitente do CTe): é a mesma em todas as linhas
+                    if rows: self.transportadoras.adicionar(rows[0], 'cte')
+                    for r in rows:
+                        self.chaves_nf.add(r['chave_nf'])
+                        self.objs_cte.append(Cte(
+                            chave_cte_propria=r['chave_cte_propria'], chave_nf=r['chave_nf'], data=_parse_date(r['data']),
+                            numero_cte=r['numero_cte'], emitente=r['emitente'], cnpj_emit=r['cnpj_emit'],
+                            remetente=r['remetente'], destinatario=r['destinatario'], frete_valor=r['frete_valor'],
+                            peso_kg=r['peso_kg'], numero_nf_cte=r['numero_nf_cte'], cidade_origem=r['cidade_origem'],
+                            cidade_destino=r['cidade_destino'], pedagio_valor=r['pedagio_valor'], tp_cte=r['tp_cte'], arquivo=fname
+                        ))
+
+            elif tipo == 'nfe':
+                # Header e itens saem do mesmo parse (antes eram duas passadas no XML)
+                header, items, err = res['header'], res['items'], res['erro']
+                if err: self.logs.append(Log(arquivo=fname, tipo_doc='NF-e', status='ERRO', mensagem=err))
+                else:
+                    # 2. Cadastra Cliente (em lote, no save_batch) e Transportadora
+                    self.clientes.adicionar(header)
+                    self.transportadoras.adicionar(header, 'nfe')
+                    self.chaves_nf.add(header['chave_nf'])
+
+                    self.objs_nfe.append(Nfe(
+                        chave_nf=header['chave_nf'], data=_parse_date(header['data']), numero_nf=header['numero_nf'],
+                        emitente=header['emitente'], destinatario=header['destinatario'], cnpj_emit=header['cnpj_emit'],
+                        cnpj_dest=header['cnpj_dest'], uf_dest=header['uf_dest'], valor_nf=header['valor_nf'],
+                        peso_bruto=header['peso_bruto'], transportadora=header['transportadora'], cidade_origem=header['cidade_origem'],
+                        cidade_destino=header['cidade_destino'], mod_frete=header['mod_frete'], cfop_predominante=header['cfop_predominante'],
+                        tipo_operacao=header['tipo_operacao'], qtd_itens=header['qtd_itens'], arquivo=fname,
+
+                        cep_origem=header.get('cep_emit'),
+                        cep_destino=header.get('cep_dest'),
+                        distancia=0
+                    ))
+
+                    for i in items:
+                        # Peso vem do mapa em memória (zero query por item)
+                        peso_unitario_real = float(self.pesos.peso(i['produto']))
+                        qtd = float(i['qtd_float'])
+                        peso_total_item = peso_unitario_real * qtd
+
+                        str_peso_unitario = br_weight(peso_unitario_real)
+                        qtd_fmt_num = f"{int(qtd)}" if qtd.is_integer() else f"{qtd:g}".replace('.', ',')
+                        str_qtd_comercial = f"{qtd_fmt_num} {i['unidade']}"
+
+                        self.objs_item.append(Item(
+                            chave_nf=i['chave_nf'], numero_nf=i['numero_nf'], emitente=i['emitente'], item_num=i['item_num'],
+                            produto=i['produto'], ncm=i['ncm'], cfop=i['cfop'], unidade=i['unidade'],
+                            qtd_display=str_peso_unitario, qtd_formatada=str_qtd_comercial,
+                            qtd_float=i['qtd_float'], vl_total=i['vl_total'],
+                            peso_estimado_total=peso_total_item, arquivo=fname
+                        ))
+            if chave: self.chaves_lote.add(chave)
+        except Exception as e:
+            self.logs.append(Log(arquivo=fname, tipo_doc=tipo, status='ERRO FATAL', mensagem=str(e)))
+        return True
+
+# ==============================================================================
+# DATAFRAME DO DASHBOARD (SNAPSHOT EM DISCO + ATUALIZAÇÃO INCREMENTAL)
+# ==============================================================================
+# Só os campos que o montar_dashboard_df usa, com o tipo NumPy de cada um
+# (Decimal vira float64, None vira NaN/NaT; texto fica em object)
+CAMPOS_NFE_DASH = {
+    'chave_nf': object, 'numero_nf': object, 'data': 'datetime64[D]', 'emitente': object, 'destinatario': object,
+    'cnpj_emit': object, 'cnpj_dest': object, 'valor_nf': 'float64', 'peso_bruto': 'float64', 'transportadora': object,
+    'cidade_origem': object, 'cidade_destino': object, 'mod_frete': object,
+}
+CAMPOS_CTE_DASH = {
+    'chave_cte_propria': object, 'chave_nf': object, 'numero_cte': object, 'emitente': object,
+    'frete_valor': 'float64', 'pedagio_valor': 'float64', 'peso_kg': 'float64', 'tp_cte': object,
+}
+CAMPOS_CLIENTE_DASH = {'cpf_cnpj': object, 'latitude': 'float64', 'longitude': 'float64', 'distancia_km': 'float64'}
+LOTE_LEITURA = 10000
+
+def ler_colunas(qs, campos, lote=LOTE_LEITURA):
+    """
+    DataFrame só com os campos pedidos ({campo: dtype}), lido do banco em
+    lotes (values_list + iterator) e convertido lote a lote em arrays NumPy
+    tipados. Nada de list(qs.values()): nem as colunas que o dashboard não
+    usa (arquivo, data_importacao...) nem um dict por linha passam pela memória.
+    """
+    nomes = list(campos)
+    partes = {nome: [] for nome in nomes}
+    linhas = qs.values_list(*nomes).iterator(chunk_size=lote)
+    while True:
+        bloco = list(islice(linhas, lote))
+        if not bloco: break
+        for nome, valores in zip(nomes, zip(*bloco)):
+            partes[nome].append(np.array(valores, dtype=campos[nome]))
+    return pd.DataFrame({
+        nome: np.concatenate(p) if p else np.array([], dtype=campos[nome]) for nome, p in partes.items()
+    })
+
+def _ler_por_chaves(qs, campo, valores, campos):
+    # Mesmo ler_colunas, com o filtro campo__in em blocos (limite de parâmetros do SQLite)
+    partes = [ler_colunas(qs.filter(**{f"{campo}__in": bloco}), campos) for bloco in _em_blocos(valores)]
+    return pd.concat(partes, ignore_index=True) if partes else ler_colunas(qs.none(), campos)
+
+def get_dashboard_data(filtros=None):
+    """
+    DataFrame do dashboard, do snapshot Arrow compartilhado entre os workers
+    (ver snapshot.py). Com filtro de ano/mês vêm só as partições mensais do
+    período; quem chama aplica a máscara dos filtros por cima. Sem snapshot
+    monta o histórico inteiro a partir do banco e o publica.
+    """
+    filtros = filtros or {}
+    anos = {int(v) for v in filtros.get('ano') or [] if str(v).isdigit()}
+    meses = {int(v) for v in filtros.get('mes') or [] if str(v).isdigit()}
+    df = snapshot.carregar(anos, meses)
+    if df is not None: return df
+    with snapshot.trava():
+        # Outro processo pode ter publicado enquanto esperávamos a trava
+        df = snapshot.carregar(anos, meses)
+        if df is not None: return df
+
+        nf_qs = ler_colunas(Nfe.objects.all(), CAMPOS_NFE_DASH)
+        cte_qs = ler_colunas(Cte.objects.all(), CAMPOS_CTE_DASH)
+        clientes_qs = ler_colunas(Cliente.objects.all(), CAMPOS_CLIENTE_DASH)
+        df = montar_dashboard_df(nf_qs, cte_qs, clientes_qs)
+        if not df.empty:
+            snapshot.publicar(df)
+            print(f">>> DASHBOARD: {len(df)} notas, {df.memory_usage(deep=True).sum() / 1024 / 1024:,.1f} MB em memória.")
+        # O cubo acompanha cada montagem completa: exclusões e edições no admin ou
+        # CNPJS_CIA trocado não deixam o dashboard diferente da análise
+        reconstruir_resumo(df)
+    return df
+
+def limpar_dashboard():
+    snapshot.invalidar()
+
+def _em_blocos(valores, tamanho=1000):
+    valores = list(valores)
+    for i in range(0, len(valores), tamanho): yield valores[i:i + tamanho]
+
+def _ctes_das_notas(chaves_nf):
+    ctes = set()
+    for bloco in _em_blocos(chaves_nf):
+        ctes.update(Cte.objects.filter(chave_nf__in=bloco).values_list('chave_cte_propria', flat=True))
+    return ctes
+
+def notas_afetadas(chaves_nf):
+    """As notas informadas mais as que dividem algum CT-e com elas."""
+    afetadas = set(chaves_nf)
+    for bloco in _em_blocos(_ctes_das_notas(chaves_nf)):
+        afetadas.update(Cte.objects.filter(chave_cte_propria__in=bloco).values_list('chave_nf', flat=True))
+    return afetadas
+
+def montar_notas(chaves_nf):
+    """
+    Linhas do dashboard só das notas informadas, com o rateio correto: carrega
+    todos os CT-es dessas notas e o peso de todas as notas desses CT-es.
+    """
+    chaves_nf = {str(c).strip() for c in chaves_nf if c}
+    # Fatia vazia volta com as colunas do dashboard: as views selecionam colunas dela
+    if not chaves_nf: return tipar_dashboard(pd.DataFrame())
+    cte_qs = _ler_por_chaves(Cte.objects.all(), 'chave_cte_propria', _ctes_das_notas(chaves_nf), CAMPOS_CTE_DASH)
+    chaves_cte = {str(c).strip() for c in cte_qs['chave_nf']}
+    nf_qs = _ler_por_chaves(Nfe.objects.all(), 'chave_nf', chaves_nf | chaves_cte, CAMPOS_NFE_DASH)
+    cnpjs = {str(c).strip() for c in nf_qs['cnpj_dest']}
+    clientes_qs = _ler_por_chaves(Cliente.objects.all(), 'cpf_cnpj', cnpjs, CAMPOS_CLIENTE_DASH)
+
+    df = montar_dashboard_df(nf_qs, cte_qs, clientes_qs)
+    if df.empty: return tipar_dashboard(df)
+    return df[df['chave_nf'].isin(chaves_nf)].reset_index(drop=True)
+
+def atualizar_dashboard(chaves_nf):
+    """
+    Recalcula no snapshot do dashboard só as notas tocadas e as que dividem
+    CT-e com elas (o rateio do frete depende do peso de todas as notas do CT-e).
+    Sem snapshot publicado não faz nada: o próximo acesso monta tudo do zero.
+    """
+    chaves_nf = {str(c).strip() for c in chaves_nf if c}
+    if not chaves_nf: return
+    if snapshot.versao_publicada() is None: return
+
+    # 1. Notas afetadas = tocadas + irmãs de CT-e
+    afetadas = notas_afetadas(chaves_nf)
+
+    # 2. Troca as linhas antigas pelas recalculadas, só nas partições mensais em que
+    # elas estão (ler a versão e publicar a próxima acontece sob a trava do snapshot).
+    # concat de categorias diferentes volta a object: tipar_dashboard retipa cada partição
+    novos = montar_notas(afetadas)
+    regravadas = snapshot.republicar(afetadas, novos, tipar_dashboard)
+    if regravadas is None: return
+    print(f">>> DASHBOARD: {len(afetadas)} notas recalculadas no snapshot (partições {', '.join(regravadas) or '-'}).")
+
+# CNPJs da companhia normalizados uma vez só (não a cada rebuild)
+if isinstance(CNPJS_CIA, dict):
+    MEUS_CNPJS = {limpar_cnpj(str(c)) for c in CNPJS_CIA.keys()}
+    DE_PARA_CNPJ = {limpar_cnpj(str(k)): v for k, v in CNPJS_CIA.items()}
+else:
+    MEUS_CNPJS = {limpar_cnpj(str(c)) for c in CNPJS_CIA}
+    DE_PARA_CNPJ = {}
+
+def cnpj_limpo(serie):
+    """limpar_cnpj numa coluna inteira (só os dígitos)."""
+    return serie.astype(str).str.replace(r'\D', '', regex=True)
+
+def classificar_operacoes(df):
+    """Preenche Operacao, Emitente_Legivel e Destinatario_Legivel no próprio df."""
+    emit = cnpj_limpo(df['cnpj_emit']); dest = cnpj_limpo(df['cnpj_dest'])
+    eh_emitente = emit.isin(MEUS_CNPJS).to_numpy()
+    eh_destinatario = dest.isin(MEUS_CNPJS).to_numpy()
+    df['Operacao'] = np.select(
+        [eh_emitente & eh_destinatario, eh_emitente, eh_destinatario],
+        ["Transferência", "Venda", "Compra"], default="Outros"
+    )
+    # Filial conhecida vira o apelido do config; o resto mantém o nome do XML
+    nome_emit = emit.map(DE_PARA_CNPJ); nome_dest = dest.map(DE_PARA_CNPJ)
+    df['Emitente_Legivel'] = nome_emit.where(nome_emit.notna(), df['emitente'])
+    df['Destinatario_Legivel'] = nome_dest.where(nome_dest.notna(), df['destinatario'])
+    return df
 
-    nf_qs = list(Nfe.objects.all().values())
-    cte_qs = list(Cte.objects.all().values())
-    clientes_qs = list(Cliente.objects.values('cpf_cnpj', 'latitude', 'longitude', 'distancia_km'))
+# ==============================================================================
+# ESQUEMA TIPADO DO DATAFRAME DO DASHBOARD
+# ==============================================================================
+# Só as colunas que as views, o cubo e o snapshot usam. Texto repetitivo vira
+# category (cada valor guardado uma vez; isin/groupby comparam códigos inteiros),
+# chaves e números ficam em string (o que falta continua NA, não vira 'None'/'nan'),
+# dinheiro e peso ficam em float64 para os KPIs não mudarem, o resto encolhe.
+ESQUEMA_DASHBOARD = {
+    'chave_nf': 'string', 'numero_nf': 'string', 'numero_cte': 'string', 'cte_complementar': 'string',
+    'data': 'datetime64[s]', 'Ano': 'int16', 'Mes': 'int8', 'Dia': 'int8',
+    'destinatario': 'category', 'cidade_origem': 'category', 'cidade_destino': 'category', 'UF_Dest': 'category',
+    'Emitente_Legivel': 'category', 'Destinatario_Legivel': 'category', 'Transportadora_Final': 'category',
+    'Frete_Tipo': 'category', 'Operacao': 'category',
+    'valor_nf': 'float64', 'peso_bruto': 'float64', 'frete_valor': 'float64', 'pedagio_valor': 'float64',
+    'peso_cte_total': 'float64', 'distancia_km': 'float32', 'latitude': 'float32', 'longitude': 'float32',
+}
+
+def tipar_dashboard(df):
+    """Reduz o DataFrame às colunas do ESQUEMA_DASHBOARD, cada uma com o seu tipo (vazio também)."""
+    df = df.reindex(columns=list(ESQUEMA_DASHBOARD))
+    for col, tipo in ESQUEMA_DASHBOARD.items():
+        if tipo == 'category':
+            df[col] = df[col].astype('category').cat.remove_unused_categories()
+        elif tipo.startswith('datetime'):
+            df[col] = pd.to_datetime(df[col], errors='coerce').astype(tipo)
+        else:
+            df[col] = df[col].astype(tipo)
+    return df
+
+def montar_dashboard_df(nf_qs, cte_qs, clientes_qs, regra_rateio=None, tipar=True):
+    """
+    Monta o DataFrame do dashboard a partir das linhas de Nfe, Cte e Cliente
+    (DataFrames do ler_colunas ou listas de dicts). tipar=False devolve o
+    DataFrame bruto, com todas as colunas (usado pelo bench_dashboard para
+    comparar).
+    """
     df_clientes = pd.DataFrame(clientes_qs)
 
     df_n = pd.DataFrame(nf_qs)
@@ -154,23 +636,12 @@ def get_dashboard_data():
         if 'tp_cte' not in df_c.columns: df_c['tp_cte'] = '0'
         df_c['tp_cte'] = df_c['tp_cte'].fillna('0').astype(str)
 
-        pesos_nf = df_n[['chave_nf', 'peso_bruto']].rename(columns={'peso_bruto': 'peso_nf_ref'})
-        df_c_calc = pd.merge(df_c, pesos_nf, on='chave_nf', how='left')
+        bases_nf = df_n[['chave_nf', 'peso_bruto', 'valor_nf']].rename(columns={'peso_bruto': 'peso_nf_ref', 'valor_nf': 'valor_nf_ref'})
+        df_c_calc = pd.merge(df_c, bases_nf, on='chave_nf', how='left')
         df_c_calc['peso_nf_ref'] = df_c_calc['peso_nf_ref'].fillna(0)
-        
-        cte_totals = df_c_calc.groupby('chave_cte_propria').agg(total_peso_cte=('peso_nf_ref', 'sum'), qtd_notas=('chave_nf', 'count')).reset_index()
-        df_c_calc = pd.merge(df_c_calc, cte_totals, on='chave_cte_propria', how='left')
-        
-        def calcular_parcela(row):
-            total_frete = float(row['frete_valor'])
-            total_peso = float(row['total_peso_cte'])
-            peso_indiv = float(row['peso_nf_ref'])
-            qtd = row['qtd_notas']
-            if total_frete == 0: return 0.0
-            if total_peso > 0: return total_frete * (peso_indiv / total_peso)
-            else: return total_frete / qtd if qtd > 0 else total_frete
-
-        df_c_calc['frete_rateado'] = df_c_calc.apply(calcular_parcela, axis=1)
+        df_c_calc['valor_nf_ref'] = df_c_calc['valor_nf_ref'].fillna(0)
+
+        df_c_calc['frete_rateado'] = ratear_frete(df_c_calc, regra=regra_rateio or settings.RATEIO_FRETE)
         df_c_calc['pedagio_rateado'] = df_c_calc['pedagio_valor']
         df_c_calc['is_complementar'] = df_c_calc['tp_cte'] == '1'
         
@@ -219,35 +690,91 @@ def get_dashboard_data():
          df['Frete_Tipo'] = df['mod_frete'].apply(lambda x: 'CIF' if str(x)=='0' else ('FOB' if str(x)=='1' else 'Outros'))
     else: df['Frete_Tipo'] = 'Outros'
 
-    if isinstance(CNPJS_CIA, dict):
-        MEUS_CNPJS = set([limpar_cnpj(str(c)) for c in CNPJS_CIA.keys()])
-        DE_PARA_CNPJ = {limpar_cnpj(str(k)): v for k, v in CNPJS_CIA.items()}
-    else:
-        MEUS_CNPJS = set([limpar_cnpj(str(c)) for c in CNPJS_CIA])
-        DE_PARA_CNPJ = {}
-
-    def recalcular_operacao(row):
-        emit = limpar_cnpj(str(row['cnpj_emit']))
-        dest = limpar_cnpj(str(row['cnpj_dest']))
-        eh_emitente = emit in MEUS_CNPJS
-        eh_destinatario = dest in MEUS_CNPJS
-        if eh_emitente and eh_destinatario: return "Transferência"
-        elif eh_emitente and not eh_destinatario: return "Venda"
-        elif not eh_emitente and eh_destinatario: return "Compra"
-        else: return "Outros"
-
-    df['Operacao'] = df.apply(recalcular_operacao, axis=1)
-
-    def traduzir_empresa(row, col_nome, col_cnpj):
-        cnpj_limpo = limpar_cnpj(str(row[col_cnpj]))
-        if cnpj_limpo in DE_PARA_CNPJ: return DE_PARA_CNPJ[cnpj_limpo]
-        return row[col_nome]
-
-    df['Emitente_Legivel'] = df.apply(lambda x: traduzir_empresa(x, 'emitente', 'cnpj_emit'), axis=1)
-    df['Destinatario_Legivel'] = df.apply(lambda x: traduzir_empresa(x, 'destinatario', 'cnpj_dest'), axis=1)
-    
-    cache.set('dashboard_df', df, 3600)
-    return df
+    # Transferência/Venda/Compra/Outros e nomes das filiais em operações vetorizadas
+    classificar_operacoes(df)
+    return tipar_dashboard(df) if tipar else df
+
+# ==============================================================================
+# RESUMO DIÁRIO (CUBO DOS KPIs E GRÁFICOS DO DASHBOARD)
+# ==============================================================================
+# Coluna do DataFrame do dashboard -> campo do ResumoDiario
+DIMENSOES_RESUMO = {
+    'data': 'data', 'Emitente_Legivel': 'emitente_legivel', 'Destinatario_Legivel': 'destinatario_legivel',
+    'cidade_destino': 'cidade_destino', 'UF_Dest': 'uf_dest', 'Transportadora_Final': 'transportadora_final',
+    'Frete_Tipo': 'frete_tipo', 'Operacao': 'operacao',
+}
+METRICAS_RESUMO = ('frete_valor', 'valor_nf', 'pedagio_valor', 'peso_bruto')
+
+def _hash_dimensoes(valores):
+    # NULL ('\0') diferente de texto vazio; '\x1f' separa as dimensões
+    texto = '\x1f'.join('\0' if v is None else str(v) for v in valores)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+def _linhas_resumo(df):
+    if df.empty: return []
+    df = df.assign(data=pd.to_datetime(df['data'], errors='coerce').dt.date, qtd_notas=1)
+    dims = list(DIMENSOES_RESUMO)
+    agg = df.groupby(dims, dropna=False, observed=True)[list(METRICAS_RESUMO) + ['qtd_notas']].sum().reset_index()
+    agg = agg.astype(object).where(agg.notna(), None)
+    return [
+        ResumoDiario(**{campo: r[col] for col, campo in DIMENSOES_RESUMO.items()},
+                     dimensoes_hash=_hash_dimensoes(r[col] for col in dims),
+                     **{m: float(r[m] or 0) for m in METRICAS_RESUMO}, qtd_notas=int(r['qtd_notas']))
+        for r in agg.to_dict('records')
+    ]
+
+def _travar_resumo():
+    """Dentro de um atomic: trava a linha sentinela do cubo até o commit."""
+    return TravaResumo.objects.select_for_update().get_or_create(pk=1)[0]
+
+def reconstruir_resumo(df=None):
+    """Refaz o cubo inteiro a partir do DataFrame do dashboard (o recém-montado, se vier)."""
+    if df is None: df = get_dashboard_data()
+    linhas = _linhas_resumo(df)
+    with transaction.atomic():
+        trava = _travar_resumo()
+        ResumoDiario.objects.all().delete()
+        ResumoDiario.objects.bulk_create(linhas, batch_size=1000)
+        trava.reconstruido_em = timezone.now()
+        trava.save(update_fields=['reconstruido_em'])
+    print(f">>> RESUMO: cubo reconstruído com {len(linhas)} linhas.")
+
+def atualizar_resumo(chaves_nf, dias=()):
+    """
+    Refaz só os dias tocados: os dias das notas afetadas (incluindo as irmãs
+    de CT-e, cujo rateio pode ter mudado) são recalculados por inteiro. `dias`
+    soma dias que as notas não dizem mais (nota apagada ou com a data trocada).
+    """
+    chaves_nf = {str(c).strip() for c in chaves_nf if c}
+    dias = set(dias)
+    if not chaves_nf and not dias: return
+    with transaction.atomic():
+        # Lido e regravado sob a trava: duas atualizações do mesmo dia não se sobrepõem
+        _travar_resumo()
+        for bloco in _em_blocos(notas_afetadas(chaves_nf)):
+            dias.update(Nfe.objects.filter(chave_nf__in=bloco).values_list('data', flat=True).distinct())
+        if not dias: return
+
+        com_data = [d for d in dias if d is not None]
+        q_dias = Q(data__in=com_data) | Q(data__isnull=True) if None in dias else Q(data__in=com_data)
+        notas = Nfe.objects.filter(q_dias).values_list('chave_nf', flat=True)
+        linhas = _linhas_resumo(montar_notas(notas.iterator(chunk_size=10000)))
+        ResumoDiario.objects.filter(q_dias).delete()
+        ResumoDiario.objects.bulk_create(linhas, batch_size=1000)
+    print(f">>> RESUMO: {len(dias)} dia(s) recalculados no cubo.")
+
+def resumo_pronto():
+    """
+    O cubo segue o snapshot: sem versão publicada (nunca montado, TTL vencido
+    ou limpo) get_dashboard_data monta o histórico e reconstrói o cubo junto.
+    """
+    if snapshot.versao_publicada() is None: get_dashboard_data()
+    elif not ResumoDiario.objects.exists() and Nfe.objects.exists(): reconstruir_resumo()
+
+def limpar_resumo():
+    with transaction.atomic():
+        _travar_resumo()
+        ResumoDiario.objects.all().delete()
 
 def render_dashboard_logic(request, df):
     # Apenas para manter o código compilável se você usar em views.py
@@ -0,0 +1,61 @@
+# signals.py
+# Exclusões e edições de NF-e/CT-e fora da importação (admin, shell) também
+# chegam ao cubo diário e ao snapshot do dashboard. A importação grava com
+# bulk_create, que não dispara estes sinais: ela atualiza os dois sozinha.
+# As chaves se acumulam até o commit: apagar 500 notas de uma vez no admin é
+# uma atualização só (os demais on_commit acham a fila vazia). Se a transação
+# voltar atrás, o que ficou na fila entra na próxima.
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import Nfe, Cte
+
+_pendentes = threading.local()
+# Campos da NF-e que o cubo e o snapshot não leem. O worker de geolocalização grava
+# a distância nota a nota (save com update_fields) e avisa o dashboard uma vez no fim do ciclo
+CAMPOS_FORA_DO_DASHBOARD = {'distancia'}
+
+
+def _agendar(chaves_nf=(), dias=(), ctes=()):
+    if not hasattr(_pendentes, 'chaves'):
+        _pendentes.chaves, _pendentes.dias, _pendentes.ctes = set(), set(), set()
+    _pendentes.chaves.update(c for c in chaves_nf if c)
+    _pendentes.dias.update(dias)
+    _pendentes.ctes.update(c for c in ctes if c)
+    transaction.on_commit(_processar)
+
+def _processar():
+    from . import services
+    if not hasattr(_pendentes, 'chaves'): return
+    chaves, dias, ctes = _pendentes.chaves, _pendentes.dias, _pendentes.ctes
+    del _pendentes.chaves, _pendentes.dias, _pendentes.ctes
+    # Notas que continuam num CT-e alterado: o rateio do frete delas mudou
+    if ctes: chaves |= set(Cte.objects.filter(chave_cte_propria__in=ctes).values_list('chave_nf', flat=True))
+    services.atualizar_resumo(chaves, dias)
+    services.atualizar_dashboard(chaves)
+
+
+def _ignorar(raw, update_fields):
+    return raw or (update_fields is not None and set(update_fields) <= CAMPOS_FORA_DO_DASHBOARD)
+
+@receiver(pre_save, sender=Nfe)
+def guardar_dia_anterior(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Data trocada no admin: o dia antigo também sai do cubo
+    if _ignorar(raw, update_fields): return
+    instance._dias_anteriores = list(Nfe.objects.filter(pk=instance.pk).values_list('data', flat=True))
+
+@receiver(post_save, sender=Nfe)
+def nfe_salva(sender, instance, raw=False, update_fields=None, **kwargs):
+    if _ignorar(raw, update_fields): return
+    _agendar([instance.chave_nf], getattr(instance, '_dias_anteriores', []))
+
+@receiver(post_delete, sender=Nfe)
+def nfe_apagada(sender, instance, **kwargs):
+    _agendar([instance.chave_nf], [instance.data])
+
+@receiver(post_save, sender=Cte)
+@receiver(post_delete, sender=Cte)
+def cte_alterado(sender, instance, raw=False, **kwargs):
+    if raw: return
+    _agendar([instance.chave_nf], ctes=[instance.chave_cte_propria])
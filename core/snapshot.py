@@ -0,0 +1,273 @@
+# snapshot.py
+# DataFrame do dashboard salvo em disco no formato Arrow (IPC), compartilhado
+# por todos os workers do gunicorn. Quem monta o DataFrame publica uma versão
+# nova; cada worker lê o arquivo via memory-map e só recarrega quando a versão
+# muda (antes cada worker tinha sua cópia no LocMemCache e pagava o pickle a
+# cada cache.get). O que fica de fato dividido e o que cada um copia: ver _ler.
+# Cada versão é uma pasta com uma partição por mês (AAAA-MM.arrow; 0000-00 são
+# as notas sem data). Quem filtra por ano/mês carrega só as partições do
+# período, que ficam num LRU por processo (DASHBOARD_PARTICOES_MAX); o
+# histórico inteiro só é juntado quando alguém pede tudo.
+# Quem lê uma versão para publicar a seguinte (montagem completa ou
+# atualização incremental) segura a trava(), um lock de arquivo entre
+# processos: duas importações simultâneas não publicam versões irmãs em que a
+# última apaga as notas da outra.
+import glob
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+ARQUIVO_VERSAO = 'VERSAO'
+ARQUIVO_TRAVA = 'TRAVA'
+MANTER_VERSOES = 3  # versões antigas podem estar abertas em outros workers
+
+_lock = threading.Lock()
+_trava_local = threading.local()
+_atual = {'versao': None, 'df': None}
+_particoes = OrderedDict()  # (versao, 'AAAA-MM') -> DataFrame, do menos para o mais usado
+
+
+def _pasta():
+    pasta = str(settings.DASHBOARD_SNAPSHOT_DIR)
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+def _caminho(versao, particao=None):
+    pasta = os.path.join(_pasta(), f"dashboard-{versao}")
+    return os.path.join(pasta, f"{particao}.arrow") if particao else pasta
+
+def _gravar_atomico(caminho, escrever):
+    tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        escrever(tmp)
+        os.replace(tmp, caminho)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+
+@contextmanager
+def trava():
+    """
+    Lock exclusivo entre processos (e threads) para ler a versão vigente e
+    publicar a próxima. Reentrante na mesma thread.
+    """
+    if getattr(_trava_local, 'nivel', 0):
+        _trava_local.nivel += 1
+        try: yield
+        finally: _trava_local.nivel -= 1
+        return
+    with open(os.path.join(_pasta(), ARQUIVO_TRAVA), 'a+b') as f:
+        if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else: msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        _trava_local.nivel = 1
+        try:
+            yield
+        finally:
+            _trava_local.nivel = 0
+            if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def versao_publicada():
+    """Versão em vigor, ou None se não há snapshot ou ele passou do prazo (DASHBOARD_SNAPSHOT_TTL)."""
+    caminho = os.path.join(_pasta(), ARQUIVO_VERSAO)
+    try:
+        if time.time() - os.path.getmtime(caminho) > settings.DASHBOARD_SNAPSHOT_TTL: return None
+        with open(caminho, encoding='utf-8') as f: return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _ler(caminho):
+    # O que o to_pandas não copia aponta para o memory-map (páginas do cache do SO, as mesmas em
+    # todos os workers): com pandas 3 as colunas de texto (str sobre Arrow), as numéricas sem
+    # nulos e os códigos das categóricas. Cada processo tem a sua cópia só dos dicionários das
+    # categóricas (as categorias) e das colunas com nulos (int com nulo vira float, por ex.)
+    with pa.memory_map(caminho, 'r') as fonte:
+        tabela = pa.ipc.open_file(fonte).read_all()
+    return tabela.to_pandas(split_blocks=True)
+
+def _juntar(partes):
+    # Partições regravadas em versões diferentes podem ter categorias diferentes:
+    # o concat devolveria object, então as categóricas são unidas de volta
+    if len(partes) == 1: return partes[0].copy(deep=False)
+    df = pd.concat(partes, ignore_index=True)
+    for col in partes[0].columns:
+        if isinstance(partes[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = pd.api.types.union_categoricals([p[col] for p in partes], ignore_order=True)
+    return df
+
+def particoes(versao):
+    """Partições ('AAAA-MM') gravadas na versão, em ordem."""
+    return sorted(os.path.basename(c)[:-len('.arrow')] for c in glob.glob(os.path.join(_caminho(versao), '*.arrow')))
+
+def _particao(versao, nome):
+    # Chamar com o _lock: LRU das partições já convertidas para pandas neste processo
+    chave = (versao, nome)
+    if chave in _particoes:
+        _particoes.move_to_end(chave)
+    else:
+        for antiga in [k for k in _particoes if k[0] != versao]: del _particoes[antiga]
+        _particoes[chave] = _ler(_caminho(versao, nome))
+    df = _particoes[chave]
+    while len(_particoes) > settings.DASHBOARD_PARTICOES_MAX: _particoes.popitem(last=False)
+    return df
+
+
+def carregar(anos=None, meses=None):
+    """
+    DataFrame da versão publicada (None se não houver). Sem anos/meses é o
+    histórico inteiro, juntado uma vez por versão em cada processo; com eles
+    só as partições do período (as categorias são as mesmas em todas, então
+    o concat mantém os tipos). Período sem partição devolve o DataFrame vazio,
+    com as colunas.
+    """
+    versao = versao_publicada()
+    if versao is None: return None
+    with _lock:
+        try:
+            if not anos and not meses:
+                if _atual['versao'] != versao:
+                    partes = [_ler(_caminho(versao, p)) for p in particoes(versao)]
+                    if not partes: return None
+                    _atual['versao'], _atual['df'] = versao, _juntar(partes)
+                # Cópia rasa: a view pode criar colunas sem mexer no DataFrame compartilhado
+                return _atual['df'].copy(deep=False)
+            todas = particoes(versao)
+            if not todas: return None
+            nomes = [p for p in todas if (not anos or int(p[:4]) in anos) and (not meses or int(p[5:]) in meses)]
+            partes = [_particao(versao, p) for p in nomes] or [_particao(versao, todas[-1]).iloc[:0]]
+        except FileNotFoundError:
+            return None  # versão substituída e apagada no meio da leitura
+    return _juntar(partes)
+
+
+def _periodos(df):
+    return df['Ano'].astype('int32') * 100 + df['Mes'].astype('int32')
+
+def _nome_particao(valor):
+    return f"{valor // 100:04d}-{valor % 100:02d}"
+
+def _gravar_particao(caminho, df):
+    # Sem compressão: é o que permite ler por memory-map sem copiar. As
+    # categorias vão inteiras em cada partição (dicionário Arrow). NaN fica
+    # NaN, não nulo: float sem bitmap de nulos volta do mapa sem cópia
+    tabela = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    for i, campo in enumerate(tabela.schema):
+        if pa.types.is_floating(campo.type) and tabela.column(i).null_count:
+            tabela = tabela.set_column(i, campo, pc.fill_null(tabela.column(i), float('nan')))
+    with pa.OSFile(caminho, 'wb') as sink, pa.ipc.new_file(sink, tabela.schema) as writer:
+        writer.write_table(tabela)
+
+def _nova_versao(escrever_pasta):
+    """Monta a pasta da versão nova (escrever_pasta(tmp)) e a torna a vigente para todos os workers."""
+    versao = f"{time.time_ns()}-{os.getpid()}"
+    tmp = f"{_caminho(versao)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(tmp)
+        escrever_pasta(tmp)
+        os.replace(tmp, _caminho(versao))
+    finally:
+        if os.path.exists(tmp): shutil.rmtree(tmp, ignore_errors=True)
+
+    def escrever_versao(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f: f.write(versao)
+
+    _gravar_atomico(os.path.join(_pasta(), ARQUIVO_VERSAO), escrever_versao)
+    return versao
+
+
+def publicar(df):
+    """Grava uma versão nova do snapshot (uma partição por mês) e a torna a vigente para todos os workers."""
+    df = df.reset_index(drop=True)
+
+    def escrever(tmp):
+        for valor, parte in df.groupby(_periodos(df), sort=True):
+            _gravar_particao(os.path.join(tmp, f"{_nome_particao(valor)}.arrow"), parte)
+
+    with trava():
+        versao = _nova_versao(escrever)
+        with _lock:
+            _atual['versao'], _atual['df'] = versao, df.copy(deep=False)
+            _particoes.clear()
+    _limpar_antigos()
+    return versao
+
+
+def republicar(afetadas, novos, tipar):
+    """
+    Versão nova trocando as linhas das notas `afetadas` pelas de `novos`. Só
+    as partições que têm alguma dessas notas (procuradas na coluna chave_nf,
+    direto no memory-map) ou recebem linha nova são regravadas; as demais
+    entram na versão nova por hard link (cópia se o sistema de arquivos não
+    deixar). tipar(df) retipa cada partição regravada. Devolve as partições
+    regravadas, ou None sem versão publicada.
+    """
+    with trava():
+        base = versao_publicada()
+        if base is None: return None
+        todas = particoes(base)
+        if not todas: return None
+        periodos = _periodos(novos) if not novos.empty else pd.Series([], dtype='int32')
+        tocadas = {_nome_particao(int(v)) for v in periodos.unique()}
+        for nome in todas:
+            if nome in tocadas: continue
+            with pa.memory_map(_caminho(base, nome), 'r') as fonte:
+                chaves = pa.ipc.open_file(fonte).read_all().column('chave_nf')
+                if pc.any(pc.is_in(chaves, value_set=pa.array(list(afetadas), type=chaves.type))).as_py():
+                    tocadas.add(nome)
+
+        def escrever(tmp):
+            for nome in sorted(set(todas) | tocadas):
+                destino = os.path.join(tmp, f"{nome}.arrow")
+                if nome not in tocadas:
+                    try: os.link(_caminho(base, nome), destino)
+                    except OSError: shutil.copyfile(_caminho(base, nome), destino)
+                    continue
+                partes = [novos[(periodos == int(nome[:4]) * 100 + int(nome[5:])).to_numpy()]]
+                if nome in todas:
+                    antiga = _ler(_caminho(base, nome))
+                    partes.insert(0, antiga[~antiga['chave_nf'].isin(afetadas)])
+                df = tipar(pd.concat([p for p in partes if not p.empty] or partes[:1], ignore_index=True))
+                if not df.empty: _gravar_particao(destino, df)
+
+        versao = _nova_versao(escrever)
+        with _lock:
+            _atual['versao'], _atual['df'] = None, None  # o histórico inteiro é juntado de novo no próximo carregar()
+            # Partições não regravadas são as mesmas: continuam no LRU, já sob a versão nova
+            for (v, nome) in list(_particoes):
+                df = _particoes.pop((v, nome))
+                if v == base and nome not in tocadas: _particoes[(versao, nome)] = df
+    _limpar_antigos()
+    return sorted(tocadas)
+
+
+def invalidar():
+    with trava():
+        try: os.remove(os.path.join(_pasta(), ARQUIVO_VERSAO))
+        except FileNotFoundError: pass
+    with _lock:
+        _atual['versao'], _atual['df'] = None, None
+        _particoes.clear()
+
+
+def _limpar_antigos():
+    versoes = [c for c in glob.glob(os.path.join(_pasta(), 'dashboard-*')) if not c.endswith('.tmp')]
+    for antiga in sorted(versoes, key=os.path.getmtime)[:-MANTER_VERSOES]:
+        try:
+            if os.path.isdir(antiga): shutil.rmtree(antiga)
+            else: os.remove(antiga)  # arquivo único do formato anterior
+        except OSError: pass  # no Windows o arquivo pode estar mapeado por outro worker
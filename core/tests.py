@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from . import corpus, parsers
+from .rateio import REGRAS_RATEIO, ratear_frete
+
+
+# ==============================================================================
+# RATEIO DO FRETE: ratear_frete x antigo calcular_parcela
+# ==============================================================================
+def calcular_parcela_antigo(df, regra='peso'):
+    """Referência: o apply linha a linha que existia no get_dashboard_data (base por regra)."""
+    col_base = REGRAS_RATEIO[regra]
+    totais = df.groupby('chave_cte_propria').agg(total_base=(col_base, 'sum'), qtd_notas=('chave_nf', 'count')).reset_index()
+    df_calc = pd.merge(df, totais, on='chave_cte_propria', how='left')
+
+    def calcular_parcela(row):
+        total_frete = float(row['frete_valor'])
+        total_base = float(row['total_base'])
+        base_indiv = float(row[col_base])
+        qtd = row['qtd_notas']
+        if total_frete == 0: return 0.0
+        if total_base > 0: return total_frete * (base_indiv / total_base)
+        else: return total_frete / qtd if qtd > 0 else total_frete
+
+    return df_calc.apply(calcular_parcela, axis=1).to_numpy(dtype=float)
+
+
+def linhas_cte(*linhas):
+    colunas = ['chave_cte_propria', 'chave_nf', 'frete_valor', 'peso_nf_ref', 'valor_nf_ref', 'tp_cte']
+    return pd.DataFrame(list(linhas), columns=colunas)
+
+
+class RateioFreteTests(SimpleTestCase):
+    def assertIgualAoAntigo(self, df, regra='peso'):
+        novo = ratear_frete(df, regra=regra)
+        antigo = calcular_parcela_antigo(df, regra=regra)
+        np.testing.assert_allclose(novo, antigo)
+        return novo
+
+    def test_frete_zero(self):
+        df = linhas_cte(('C1', 'N1', 0.0, 10.0, 100.0, '0'), ('C1', 'N2', 0.0, 30.0, 300.0, '0'))
+        np.testing.assert_array_equal(self.assertIgualAoAntigo(df), [0.0, 0.0])
+
+    def test_cte_sem_peso_divide_igualmente(self):
+        df = linhas_cte(('C1', 'N1', 90.0, 0.0, 100.0, '0'), ('C1', 'N2', 90.0, 0.0, 200.0, '0'),
+                        ('C1', 'N3', 90.0, 0.0, 300.0, '0'))
+        np.testing.assert_allclose(self.assertIgualAoAntigo(df), [30.0, 30.0, 30.0])
+
+    def test_proporcional_ao_peso(self):
+        df = linhas_cte(('C1', 'N1', 100.0, 10.0, 500.0, '0'), ('C1', 'N2', 100.0, 30.0, 500.0, '0'))
+        np.testing.assert_allclose(self.assertIgualAoAntigo(df), [25.0, 75.0])
+
+    def test_chave_nf_vazia_ou_nula(self):
+        df = linhas_cte(('C1', '', 60.0, 0.0, 0.0, '0'), ('C1', 'N1', 60.0, 0.0, 0.0, '0'),
+                        ('C2', None, 40.0, 0.0, 0.0, '0'), ('C2', 'N2', 40.0, 0.0, 0.0, '0'),
+                        ('C3', None, 15.0, 0.0, 0.0, '0'))
+        self.assertIgualAoAntigo(df)
+
+    def test_cte_complementar(self):
+        df = linhas_cte(('C1', 'N1', 100.0, 10.0, 100.0, '0'), ('C1', 'N2', 100.0, 10.0, 100.0, '0'),
+                        ('C1C', 'N1', 20.0, 10.0, 100.0, '1'), ('C1C', 'N2', 20.0, 30.0, 100.0, '1'))
+        np.testing.assert_allclose(self.assertIgualAoAntigo(df), [50.0, 50.0, 5.0, 15.0])
+
+    def test_regra_valor(self):
+        df = linhas_cte(('C1', 'N1', 100.0, 30.0, 100.0, '0'), ('C1', 'N2', 100.0, 10.0, 300.0, '0'),
+                        ('C2', 'N3', 50.0, 5.0, 0.0, '0'), ('C2', 'N4', 50.0, 5.0, 0.0, '0'))
+        np.testing.assert_allclose(self.assertIgualAoAntigo(df, regra='valor'), [25.0, 75.0, 25.0, 25.0])
+
+    def test_regra_desconhecida(self):
+        with self.assertRaises(ValueError):
+            ratear_frete(linhas_cte(('C1', 'N1', 1.0, 1.0, 1.0, '0')), regra='volume')
+
+
+# ==============================================================================
+# PARSER DE CTE: parse_cte x parse_cte_antigo (referência)
+# ==============================================================================
+class ParserCteTests(SimpleTestCase):
+    def test_mesmas_linhas_do_parser_antigo(self):
+        _, ctes = corpus.gerar_documentos(60, itens_por_nfe=2, nfs_por_cte=3)
+        self.assertTrue(ctes)
+        for nome, conteudo in ctes:
+            self.assertEqual(parsers.parse_cte(conteudo, nome), parsers.parse_cte_antigo(conteudo, nome), nome)
+
+    def test_xml_invalido(self):
+        self.assertEqual(parsers.parse_cte(b'<x/>', 'x.xml'), parsers.parse_cte_antigo(b'<x/>', 'x.xml'))
+
@@ -5,8 +5,10 @@ from . import views
 urlpatterns = [
     # Rotas da Aplicação
     path('', views.dashboard, name='dashboard'),
+    path('api/chart/<str:nome>/', views.grafico, name='grafico'),
     path('upload/', views.upload_files, name='upload'),
     path('analise/', views.analise, name='analise'),
+    path('api/analise/docs/', views.analise_docs, name='analise_docs'),
 
     # Rotas de Autenticação
     path('login/', auth_views.LoginView.as_view(template_name='core/login.html'), name='login'),
@@ -1,7 +1,10 @@
 import re
 import time
 import requests
+from datetime import timedelta
 from unicodedata import normalize
+from django.conf import settings
+from django.utils import timezone
 
 # ==============================================================================
 # CONFIGURAÇÕES GERAIS
@@ -92,6 +95,27 @@ def extrair_peso_do_nome(nome):
 # GEOLOCALIZAÇÃO E ROTAS
 # ==============================================================================
 
+def normalizar_consulta_geo(q):
+    """Chave do GeoCache: a consulta do Nominatim sem diferença de caixa nem de espaços."""
+    return ' '.join(str(q).upper().split())
+
+def ler_geo_cache(chave):
+    """Linha do GeoCache ainda válida para a consulta (positiva ou negativa), ou None."""
+    from .models import GeoCache
+    linha = GeoCache.objects.filter(consulta=chave).first()
+    if linha is None: return None
+    dias = settings.GEOCODE_CACHE_DIAS if linha.encontrado else settings.GEOCODE_CACHE_NEGATIVO_DIAS
+    return linha if linha.data_atualizacao >= timezone.now() - timedelta(days=dias) else None
+
+def gravar_geo_cache(chave, lat=None, lon=None):
+    """Guarda o resultado da consulta; sem lat/lon é uma busca que não achou nada."""
+    from .models import GeoCache
+    if len(chave) > GeoCache._meta.get_field('consulta').max_length: return
+    try:
+        GeoCache.objects.update_or_create(consulta=chave, defaults={'encontrado': lat is not None, 'latitude': lat, 'longitude': lon})
+    except Exception as e:
+        print(f"⚠️ Erro ao gravar cache Geo: {e}")
+
 def get_lat_lon(endereco, bairro, cidade, uf, cep):
     base_url = "https://nominatim.openstreetmap.org/search"
     headers = {'User-Agent': 'LeitorFiscalMaster/4.0'}
@@ -120,18 +144,28 @@ def get_lat_lon(endereco, bairro, cidade, uf, cep):
 
     for q in queries:
         if not q.strip(): continue
+        # GeoCache antes da rede: achado devolve na hora, "não achado" recente pula a consulta (e o sleep)
+        chave = normalizar_consulta_geo(q)
+        em_cache = ler_geo_cache(chave)
+        if em_cache is not None:
+            if em_cache.encontrado: return em_cache.latitude, em_cache.longitude
+            continue
         try:
             time.sleep(1.1) 
             params = {'q': q, 'format': 'json', 'limit': 1}
             response = requests.get(base_url, params=params, headers=headers, timeout=4)
-            if response.status_code == 200:
-                data = response.json()
-                # CORREÇÃO: Verifica se data[0] existe E se é um dicionário
-                if data and isinstance(data, list) and isinstance(data[0], dict): 
-                    return float(data[0].get('lat', 0)), float(data[0].get('lon', 0))
+            if response.status_code != 200: continue  # erro/limite do serviço não vai para o cache
+            data = response.json()
+            # CORREÇÃO: Verifica se data[0] existe E se é um dicionário
+            if data and isinstance(data, list) and isinstance(data[0], dict): 
+                lat, lon = float(data[0].get('lat', 0)), float(data[0].get('lon', 0))
+            else:
+                lat = lon = None
         except Exception as e:
             print(f"⚠️ Erro Query Geo: {e}")
             continue
+        gravar_geo_cache(chave, lat, lon)
+        if lat is not None: return lat, lon
 
     return COORDS_UF.get(uf, (None, None))
 
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -94,4 +95,56 @@ LOGOUT_REDIRECT_URL = 'login'    # Se deslogar, volta pra cá
 
 # Aumenta o limite de campos no POST (Padrão é 1000)
 # Necessário para selecionar muitos itens no Admin e exportar/deletar
-DATA_UPLOAD_MAX_NUMBER_FIELDS = 50000
\ No newline at end of file
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 50000
+
+# Importação de XML: quantos processos fazem o parse em paralelo (0 ou 1 = serial)
+# e quantos XMLs cada processo recebe por vez
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', '0'))
+PARSE_LOTE = int(os.environ.get('PARSE_LOTE', '50'))
+
+# Orçamento de memória da importação: total de objetos (NF-e, CT-e, itens e logs)
+# acumulados antes de gravar um lote no banco
+IMPORT_MAX_OBJETOS = int(os.environ.get('IMPORT_MAX_OBJETOS', '20000'))
+
+# Uploads acima deste tamanho vão para arquivo temporário em disco, não para a RAM
+# (abaixo dos 2,5 MB padrão do Django: cada XML/ZIP maior que isso não ocupa o processo)
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_MEMORY_SIZE', str(1024 * 1024)))
+
+# Regra do rateio do frete de um CT-e entre as suas notas: 'peso' (padrão) ou 'valor'
+RATEIO_FRETE = os.environ.get('RATEIO_FRETE', 'peso')
+if RATEIO_FRETE not in ('peso', 'valor'):  # mesmas chaves de core.rateio.REGRAS_RATEIO
+    raise ImproperlyConfigured(f"RATEIO_FRETE inválido: {RATEIO_FRETE!r} (use 'peso' ou 'valor')")
+
+# Cache das consultas ao Nominatim (GeoCache): dias até buscar de novo um endereço achado / não achado
+GEOCODE_CACHE_DIAS = int(os.environ.get('GEOCODE_CACHE_DIAS', '180'))
+GEOCODE_CACHE_NEGATIVO_DIAS = int(os.environ.get('GEOCODE_CACHE_NEGATIVO_DIAS', '7'))
+
+# Snapshot do DataFrame do dashboard (Arrow em disco, lido por memory-map por todos os workers).
+# Passado o TTL (segundos) o próximo acesso monta tudo de novo a partir do banco.
+DASHBOARD_SNAPSHOT_DIR = os.environ.get('DASHBOARD_SNAPSHOT_DIR', str(BASE_DIR / 'dados' / 'dashboard'))
+DASHBOARD_SNAPSHOT_TTL = int(os.environ.get('DASHBOARD_SNAPSHOT_TTL', '3600'))
+# Partições mensais do snapshot mantidas em memória por processo (LRU) para os filtros por ano/mês
+DASHBOARD_PARTICOES_MAX = int(os.environ.get('DASHBOARD_PARTICOES_MAX', '24'))
+
+# Gráficos do dashboard já renderizados (JSON por versão do snapshot + filtros), com descarte LRU.
+# Com DASHBOARD_GRAFICOS_REDIS (ex.: redis://localhost:6379/2) ficam num Redis dividido por todos
+# os workers: o gráfico montado por um serve aos outros. O limite e o LRU são do próprio Redis
+# (maxmemory + maxmemory-policy allkeys-lru), e "Limpar cache" esvazia o banco da URL inteiro:
+# use um só para isso. Sem Redis (desenvolvimento) é um LocMemCache, LRU por processo.
+DASHBOARD_GRAFICOS_REDIS = os.environ.get('DASHBOARD_GRAFICOS_REDIS')
+if DASHBOARD_GRAFICOS_REDIS:
+    CACHE_GRAFICOS = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': DASHBOARD_GRAFICOS_REDIS}
+else:
+    CACHE_GRAFICOS = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graficos',
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('DASHBOARD_GRAFICOS_MAX', '330')), 'CULL_FREQUENCY': 10},
+    }
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'graficos': {**CACHE_GRAFICOS, 'TIMEOUT': DASHBOARD_SNAPSHOT_TTL},
+}
+
+# Dashboard/análise com filtro: até este nº de notas na fatia os filtros e KPIs vão para o banco
+# mesmo com o snapshot pronto (acima disso filtrar o snapshot em memória é mais rápido)
+DASHBOARD_FATIA_MAX = int(os.environ.get('DASHBOARD_FATIA_MAX', '50000'))